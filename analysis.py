@@ -1,19 +1,32 @@
 import os
-import io
-from datetime import datetime
+import json
+import time
+import uuid
+import asyncio
+from datetime import datetime, timedelta
 
+import anyio
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import pandas as pd
+from typing import Optional
 from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
-import boto3
-from botocore.exceptions import ClientError
-import aiohttp
 
 # Import authentication dependency
 from authbadapi import get_current_user
 from rate_limiter import require_ai_limit, require_general_limit
+from upload import (
+    load_profile,
+    store_profile,
+    profile_upload,
+    sample_upload
+)
+from llm_client import deepseek_client, LLMError, DEEPSEEK_API_KEY
+from prompt_builder import build_prompt, AI_PROMPT_TOKEN_BUDGET
 
 # Load .env
 load_dotenv()
@@ -24,161 +37,368 @@ client = MongoClient(MONGO_URI)
 db = client["auth_db"]
 uploads_collection = db["uploads"]
 ai_summaries_collection = db["ai_summaries"]
+summary_leases_collection = db["ai_summary_leases"]
+summary_cache_collection = db["summary_cache"]
+
+# Sampling mode: large files without a stored profile are summarised from a few R2 range reads
+AI_SAMPLE_THRESHOLD_MB = int(os.getenv("AI_SAMPLE_THRESHOLD_MB", "50"))
+AI_SAMPLE_BLOCKS = int(os.getenv("AI_SAMPLE_BLOCKS", "8"))
+AI_SAMPLE_BLOCK_KB = int(os.getenv("AI_SAMPLE_BLOCK_KB", "256"))
+
+# Single-flight: one summary generation per (user_id, file_id) at a time, across workers.
+# The lease should outlast profiling plus the DeepSeek call; waiters give up (503) after the same time.
+AI_SUMMARY_LEASE_SECONDS = int(os.getenv("AI_SUMMARY_LEASE_SECONDS", "300"))
+AI_SUMMARY_LEASE_POLL_SECONDS = float(os.getenv("AI_SUMMARY_LEASE_POLL_SECONDS", "1"))
 
-# Cloudflare R2 setup
-R2_ACCOUNT_ID = os.getenv("R2_ACCOUNT_ID")
-R2_ACCESS_KEY_ID = os.getenv("R2_ACCESS_KEY_ID")
-R2_SECRET_ACCESS_KEY = os.getenv("R2_SECRET_ACCESS_KEY")
-R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME")
+summary_leases_collection.create_index("expires_at", expireAfterSeconds=0)
 
-# DeepSeek API setup
-DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+# Summaries shared by content: _id is "{file_hash}:{model}:{prompt_version}"
+SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("SUMMARY_CACHE_TTL_SECONDS", "2592000"))
+summary_cache_collection.create_index("expires_at", expireAfterSeconds=0)
 
+# In-process half of the single-flight: (user_id, file_id) key -> future of the summary response
+_inflight_summaries = {}
+
+# DeepSeek API setup (client lives in llm_client.py)
 if not DEEPSEEK_API_KEY:
     raise RuntimeError("DEEPSEEK_API_KEY not set in .env")
 
-# Initialize R2 client
-s3_client = boto3.client(
-    's3',
-    endpoint_url=f'https://{R2_ACCOUNT_ID}.r2.cloudflarestorage.com',
-    aws_access_key_id=R2_ACCESS_KEY_ID,
-    aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-    region_name='auto'
-)
-
 # Create router
 router = APIRouter()
 
 
 class AnalysisRequest(BaseModel):
     file_id: str
+    # None: sample automatically above AI_SAMPLE_THRESHOLD_MB; True/False force it on/off
+    sampling: Optional[bool] = None
 
 
-def create_analysis_package(df: pd.DataFrame) -> dict:
-    
-    #Create a compact analysis package from the DataFrame
-    
-    # Basic info
-    analysis = {
-        "row_count": len(df),
-        "column_count": len(df.columns),
-        "columns": {}
+SUMMARY_MODEL = "deepseek-chat"
+# Part of the shared summary_cache key: bump whenever the prompt or payload changes
+PROMPT_VERSION = 2
+SYSTEM_PROMPT = "You are InsightForge, a professional data analyst and business advisor. Your job is to turn raw dataset summaries into clear, actionable insights.\n\nYou write in a structured way, avoid fluff, and call out uncertainty when the data is limited. You highlight the most important patterns, anomalies, missing-data risks, and what decisions the data can support.\n\nYou do not invent facts or numbers that are not provided. If you need more information, you ask for it."
+
+
+def build_summary_prompt(analysis_package: dict) -> dict:
+
+    #Compact, token-budgeted prompt (see prompt_builder.py).
+    #Only file content goes in (no filename or user data): summaries are shared by content hash.
+
+    built = build_prompt(analysis_package, AI_PROMPT_TOKEN_BUDGET)
+    prompt = built.pop("prompt")
+    return {"prompt": prompt, "prompt_stats": built}
+
+
+def build_summary_payload(prompt: str) -> dict:
+    return {
+        "model": SUMMARY_MODEL,
+        "messages": [
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "temperature": 0.7,
+        "max_tokens": 2000
     }
+
+
+async def get_ai_summary(analysis_package: dict) -> dict:
     
-    # Column details
-    for col in df.columns:
-        col_info = {
-            "dtype": str(df[col].dtype),
-            "missing_count": int(df[col].isna().sum()),
-            "missing_percentage": round(float(df[col].isna().sum() / len(df) * 100), 2)
-        }
-        
-        # Add statistics for numeric columns
-        if pd.api.types.is_numeric_dtype(df[col]):
-            col_info["statistics"] = {
-                "mean": float(df[col].mean()) if not df[col].isna().all() else None,
-                "median": float(df[col].median()) if not df[col].isna().all() else None,
-                "std": float(df[col].std()) if not df[col].isna().all() else None,
-                "min": float(df[col].min()) if not df[col].isna().all() else None,
-                "max": float(df[col].max()) if not df[col].isna().all() else None
-            }
-        
-        analysis["columns"][col] = col_info
+    #Send analysis package to DeepSeek API and get summary
     
-    # Sample data (first 10 rows)
-    analysis["sample_rows"] = df.head(10).to_dict(orient='records')
+    built = build_summary_prompt(analysis_package)
     
-    return analysis
+    # Call DeepSeek API through the shared pooled client (timeouts, retries, concurrency cap)
+    try:
+        result = await deepseek_client.chat(build_summary_payload(built["prompt"]))
+    except LLMError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=str(e)
+        )
 
+    summary_text = result['choices'][0]['message']['content']
 
-async def get_ai_summary(analysis_package: dict, filename: str) -> dict:
-    
-    #Send analysis package to DeepSeek API and get summary
+    return {
+        "model": SUMMARY_MODEL,
+        "summary_text": summary_text,
+        "tokens_used": result.get('usage', {}),
+        "prompt_stats": built["prompt_stats"]
+    }
+
+
+def get_user_upload(file_id: str, user: dict) -> dict:
+    from bson import ObjectId
+
+    #Verify the file_id belongs to that user
+    try:
+        upload = uploads_collection.find_one({
+            "_id": ObjectId(file_id),
+            "user_id": str(user["_id"])
+        })
+    except Exception:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file_id format"
+        )
     
-    # Create detailed prompt
-    prompt = f"""You are a data analyst. Analyze this CSV file and provide a comprehensive, insightful summary.
+    if not upload:
+        raise HTTPException(
+            status_code=404,
+            detail="Upload not found or does not belong to you"
+        )
 
-File: {filename}
+    return upload
 
-Dataset Overview:
-- Total Rows: {analysis_package['row_count']}
-- Total Columns: {analysis_package['column_count']}
 
-Column Details:
-"""
+def find_cached_summary(file_id: str, user: dict):
+    # Check if summary already exists
+    return ai_summaries_collection.find_one({
+        "file_id": file_id,
+        "user_id": str(user["_id"])
+    })
+
+
+def cached_summary_response(existing_summary: dict) -> dict:
+    return {
+        "file_id": existing_summary["file_id"],
+        "summary_id": str(existing_summary["_id"]),
+        "summary": existing_summary["summary_text"],
+        "model": existing_summary["model"],
+        "created_at": existing_summary["created_at"],
+        "approximate": existing_summary.get("approximate", False),
+        "cached": True
+    }
+
+
+def content_cache_key(file_hash: str) -> str:
+    return f"{file_hash}:{SUMMARY_MODEL}:{PROMPT_VERSION}"
+
+
+def find_content_summary(upload: dict):
+    # Second cache tier: any earlier summary of identical content, whoever uploaded it
+    if not upload.get("file_hash"):
+        return None
+    return summary_cache_collection.find_one({"_id": content_cache_key(upload["file_hash"])})
+
+
+def cache_content_summary(upload: dict, ai_result: dict, analysis_package: dict):
+    # Sampled (approximate) summaries stay private to the request that asked for sampling
+    if analysis_package.get("approximate") or not upload.get("file_hash"):
+        return
+
+    now = datetime.utcnow()
+    try:
+        summary_cache_collection.update_one(
+            {"_id": content_cache_key(upload["file_hash"])},
+            {"$setOnInsert": {
+                "file_hash": upload["file_hash"],
+                "model": ai_result["model"],
+                "prompt_version": PROMPT_VERSION,
+                "summary_text": ai_result["summary_text"],
+                "tokens_used": ai_result.get("tokens_used"),
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=SUMMARY_CACHE_TTL_SECONDS)
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass
+
+
+def summary_from_content_cache(user: dict, upload: dict):
+
+    #Reuse a content-cached summary without calling DeepSeek.
+    #Still writes the user's own ai_summaries record (history, ownership, summary_id).
+
+    cached = find_content_summary(upload)
+    if not cached:
+        return None
+
+    ai_result = {
+        "model": cached["model"],
+        "summary_text": cached["summary_text"],
+        "tokens_used": {}
+    }
+    summary_doc = store_summary(user, upload, ai_result, {})
+    response = summary_response(summary_doc, {})
+    response["cached"] = True
+    return response
+
+
+def build_analysis_package(upload: dict, sampling: Optional[bool] = None) -> dict:
+
+    #Blocking (R2 + pandas): call from a worker thread in async code
+
+    # Profile computed at upload time: no download or parse needed
+    analysis_package = load_profile(upload["file_hash"])
     
-    # Add column information
-    for col_name, col_info in analysis_package['columns'].items():
-        prompt += f"\n{col_name}:"
-        prompt += f"\n  - Type: {col_info['dtype']}"
-        prompt += f"\n  - Missing: {col_info['missing_count']} ({col_info['missing_percentage']}%)"
-        
-        if 'statistics' in col_info and col_info['statistics']['mean'] is not None:
-            stats = col_info['statistics']
-            prompt += f"\n  - Mean: {stats['mean']:.2f}"
-            prompt += f"\n  - Median: {stats['median']:.2f}"
-            prompt += f"\n  - Range: [{stats['min']:.2f}, {stats['max']:.2f}]"
+    if sampling is None:
+        sampling = upload["file_size"] > AI_SAMPLE_THRESHOLD_MB * 1024 * 1024
     
-    prompt += f"\n\nSample Data (first 10 rows):\n{analysis_package['sample_rows']}"
+    if analysis_package is None and sampling:
+        # Approximate statistics from a few range reads (None if the file can't be sampled)
+        analysis_package = sample_upload(upload, AI_SAMPLE_BLOCKS, AI_SAMPLE_BLOCK_KB * 1024)
     
-    prompt += """
+    if analysis_package is None:
+        # Stream from R2 through the chunked profiler (Parquet sidecar when present)
+        analysis_package = profile_upload(upload)
+        
+        # Backfill so the next summary of this content skips the download
+        if upload.get("blob_id"):
+            store_profile(upload["file_hash"], analysis_package)
+
+    return analysis_package
 
-Please provide:
-1. A brief overview of what this dataset represents
-2. Key insights about the data quality (missing values, data types)
-3. Statistical highlights for numeric columns
-4. Any patterns or notable observations
-5. Recommendations for data analysis or cleaning
 
-Keep the summary concise but informative."""
+def store_summary(user: dict, upload: dict, ai_result: dict, analysis_package: dict) -> dict:
+    # Save result in MongoDB
+    summary_doc = {
+        "user_id": str(user["_id"]),
+        "username": user["username"],
+        "file_id": str(upload["_id"]),
+        "filename": upload["filename"],
+        "model": ai_result["model"],
+        "summary_text": ai_result["summary_text"],
+        "tokens_used": ai_result.get("tokens_used"),
+        "prompt_stats": ai_result.get("prompt_stats"),
+        "approximate": analysis_package.get("approximate", False),
+        "created_at": datetime.utcnow()
+    }
     
-    # Call DeepSeek API
+    ai_summaries_collection.insert_one(summary_doc)
+    return summary_doc
+
+
+def summary_response(summary_doc: dict, analysis_package: dict) -> dict:
+    return {
+        "file_id": summary_doc["file_id"],
+        "summary_id": str(summary_doc["_id"]),
+        "summary": summary_doc["summary_text"],
+        "model": summary_doc["model"],
+        "tokens_used": summary_doc.get("tokens_used"),
+        "prompt_stats": summary_doc.get("prompt_stats"),
+        "created_at": summary_doc["created_at"],
+        "approximate": summary_doc["approximate"],
+        "sampling": analysis_package.get("sampling"),
+        "cached": False
+    }
+
+
+def _summary_lease_key(user: dict, file_id: str) -> str:
+    return f"{user['_id']}:{file_id}"
+
+
+def acquire_summary_lease(key: str, owner: str) -> bool:
+
+    #Take the cross-worker lease for one (user_id, file_id) summary.
+    #Upserting on a missing/expired lease succeeds; a live lease makes the upsert hit the _id
+    #unique index, which means another worker is already generating this summary.
+
+    now = datetime.utcnow()
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                DEEPSEEK_API_URL,
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-                },
-                json={
-                    "model": "deepseek-chat",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": "You are InsightForge, a professional data analyst and business advisor. Your job is to turn raw dataset summaries into clear, actionable insights.\n\nYou write in a structured way, avoid fluff, and call out uncertainty when the data is limited. You highlight the most important patterns, anomalies, missing-data risks, and what decisions the data can support.\n\nYou do not invent facts or numbers that are not provided. If you need more information, you ask for it."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 2000
-                }
-            ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"DeepSeek API error: {error_text}"
-                    )
-                
-                result = await response.json()
-                summary_text = result['choices'][0]['message']['content']
+        summary_leases_collection.find_one_and_update(
+            {"_id": key, "expires_at": {"$lt": now}},
+            {"$set": {
+                "owner": owner,
+                "expires_at": now + timedelta(seconds=AI_SUMMARY_LEASE_SECONDS)
+            }},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+def release_summary_lease(key: str, owner: str):
+    summary_leases_collection.delete_one({"_id": key, "owner": owner})
+
+
+async def _compute_summary(user: dict, upload: dict, sampling: Optional[bool]) -> dict:
+    analysis_package = await run_in_threadpool(build_analysis_package, upload, sampling)
+    
+    # Send to DeepSeek API
+    ai_result = await get_ai_summary(analysis_package)
+    
+    summary_doc = await run_in_threadpool(store_summary, user, upload, ai_result, analysis_package)
+    await run_in_threadpool(cache_content_summary, upload, ai_result, analysis_package)
+    return summary_response(summary_doc, analysis_package)
+
+
+async def _generate_with_lease(user: dict, upload: dict, sampling: Optional[bool]) -> dict:
+    file_id = str(upload["_id"])
+    key = _summary_lease_key(user, file_id)
+    owner = uuid.uuid4().hex
+    deadline = time.monotonic() + AI_SUMMARY_LEASE_SECONDS
+
+    while True:
+        existing_summary = await run_in_threadpool(find_cached_summary, file_id, user)
+        if existing_summary:
+            return cached_summary_response(existing_summary)
+
+        if await run_in_threadpool(acquire_summary_lease, key, owner):
+            try:
+                # The previous holder may have saved its summary just before we got the lease
+                existing_summary = await run_in_threadpool(find_cached_summary, file_id, user)
+                if existing_summary:
+                    return cached_summary_response(existing_summary)
                 
-                return {
-                    "model": "deepseek-chat",
-                    "summary_text": summary_text,
-                    "tokens_used": result.get('usage', {})
-                }
+                # Identical content already summarised (any user): no LLM call
+                content_summary = await run_in_threadpool(summary_from_content_cache, user, upload)
+                if content_summary:
+                    return content_summary
                 
-    except aiohttp.ClientError as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to call DeepSeek API: {str(e)}"
-        )
+                return await _compute_summary(user, upload, sampling)
+            finally:
+                await run_in_threadpool(release_summary_lease, key, owner)
+
+        # Another worker holds the lease: wait for its summary instead of paying for a second one
+        if time.monotonic() > deadline:
+            raise HTTPException(
+                status_code=503,
+                detail="Summary for this file is still being generated, retry shortly"
+            )
+        await asyncio.sleep(AI_SUMMARY_LEASE_POLL_SECONDS)
+
+
+async def generate_summary(user: dict, upload: dict, sampling: Optional[bool] = None) -> dict:
+
+    #Summary for one upload, single-flight per (user_id, file_id).
+    #Concurrent callers in this process share one future; callers in other workers
+    #wait on the Mongo lease. Either way DeepSeek is called once.
+
+    key = _summary_lease_key(user, str(upload["_id"]))
+
+    pending = _inflight_summaries.get(key)
+    if pending:
+        try:
+            return await asyncio.wait_for(asyncio.shield(pending), AI_SUMMARY_LEASE_SECONDS)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail="Summary for this file is still being generated, retry shortly"
+            )
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight_summaries[key] = future
+    try:
+        result = await _generate_with_lease(user, upload, sampling)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        # Mark it retrieved: with no waiters asyncio would log it as unhandled
+        future.exception()
+        raise
+    finally:
+        if not future.done():
+            future.cancel()
+        _inflight_summaries.pop(key, None)
 
 
 @router.post("/analysis/ai-summary")
@@ -193,96 +413,13 @@ async def create_ai_summary(
     #Headers required:
         #Authorization: Bearer <your_api_key>
     
-    from bson import ObjectId
-    
     try:
         #Verify API key → get user (done by Depends)
         
-        #Verify the file_id belongs to that user
-        try:
-            upload = uploads_collection.find_one({
-                "_id": ObjectId(request.file_id),
-                "user_id": str(user["_id"])
-            })
-        except Exception:
-            raise HTTPException(
-                status_code=400,
-                detail="Invalid file_id format"
-            )
+        upload = get_user_upload(request.file_id, user)
         
-        if not upload:
-            raise HTTPException(
-                status_code=404,
-                detail="Upload not found or does not belong to you"
-            )
-        
-        # Check if summary already exists
-        existing_summary = ai_summaries_collection.find_one({
-            "file_id": request.file_id,
-            "user_id": str(user["_id"])
-        })
-        
-        if existing_summary:
-            return {
-                "file_id": request.file_id,
-                "summary": existing_summary["summary_text"],
-                "model": existing_summary["model"],
-                "created_at": existing_summary["created_at"],
-                "cached": True
-            }
-        
-        # Download CSV from R2 (stream)
-        try:
-            response = s3_client.get_object(
-                Bucket=R2_BUCKET_NAME,
-                Key=upload["r2_key"]
-            )
-            file_content = response['Body'].read()
-        except ClientError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to download file from R2: {str(e)}"
-            )
-        
-        # Load into pandas
-        try:
-            df = pd.read_csv(io.BytesIO(file_content))
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Failed to parse CSV: {str(e)}"
-            )
-        
-        # Create analysis package
-        analysis_package = create_analysis_package(df)
-        
-        # Send to DeepSeek API
-        ai_result = await get_ai_summary(analysis_package, upload["filename"])
-        
-        # Save result in MongoDB
-        summary_doc = {
-            "user_id": str(user["_id"]),
-            "username": user["username"],
-            "file_id": request.file_id,
-            "filename": upload["filename"],
-            "model": ai_result["model"],
-            "summary_text": ai_result["summary_text"],
-            "tokens_used": ai_result.get("tokens_used"),
-            "created_at": datetime.utcnow()
-        }
-        
-        result = ai_summaries_collection.insert_one(summary_doc)
-        
-        # Return the summary
-        return {
-            "file_id": request.file_id,
-            "summary_id": str(result.inserted_id),
-            "summary": ai_result["summary_text"],
-            "model": ai_result["model"],
-            "tokens_used": ai_result.get("tokens_used"),
-            "created_at": summary_doc["created_at"],
-            "cached": False
-        }
+        # Cached, joined onto an identical in-flight request, or generated now
+        return await generate_summary(user, upload, request.sampling)
         
     except HTTPException:
         raise
@@ -293,6 +430,133 @@ async def create_ai_summary(
         )
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"
+}
+
+
+@router.post("/analysis/ai-summary/stream")
+async def stream_ai_summary(
+    request: AnalysisRequest,
+    user: dict = Depends(get_current_user),
+    _ai_limit: None = Depends(require_ai_limit)
+):
+
+    #Same as /analysis/ai-summary but relays DeepSeek tokens as Server-Sent Events:
+    #"token" events carry {"delta": ...}, then one "done" (or "error") event.
+    #The assembled summary is saved once the stream completes.
+
+    upload = await run_in_threadpool(get_user_upload, request.file_id, user)
+    key = _summary_lease_key(user, request.file_id)
+
+    async def events():
+        # Lease and in-flight future are taken inside the generator, so the finally below
+        # frees them even when the client disconnects before the stream starts
+        owner = uuid.uuid4().hex
+        leased = False
+        future = None
+
+        def finish(result=None, error=None):
+            if future is not None and not future.done():
+                if error is not None:
+                    future.set_exception(error)
+                    future.exception()
+                else:
+                    future.set_result(result)
+
+        try:
+            if key not in _inflight_summaries:
+                leased = await run_in_threadpool(acquire_summary_lease, key, owner)
+
+            if not leased:
+                # Cached, or someone else is generating it: send the finished summary in one event
+                try:
+                    response = await generate_summary(user, upload, request.sampling)
+                except HTTPException as e:
+                    yield _sse("error", {"detail": e.detail})
+                    return
+                yield _sse("token", {"delta": response["summary"]})
+                done = dict(response)
+                done.pop("summary")
+                yield _sse("done", done)
+                return
+
+            # We hold the lease: stream it, and let identical requests in this process wait on the result
+            future = asyncio.get_running_loop().create_future()
+            _inflight_summaries[key] = future
+
+            existing_summary = await run_in_threadpool(find_cached_summary, request.file_id, user)
+            if existing_summary:
+                ready = cached_summary_response(existing_summary)
+            else:
+                ready = await run_in_threadpool(summary_from_content_cache, user, upload)
+
+            if ready:
+                finish(ready)
+                yield _sse("token", {"delta": ready["summary"]})
+                done = dict(ready)
+                done.pop("summary")
+                yield _sse("done", done)
+                return
+
+            analysis_package = await run_in_threadpool(build_analysis_package, upload, request.sampling)
+            built = build_summary_prompt(analysis_package)
+            payload = build_summary_payload(built["prompt"])
+
+            parts = []
+            usage = {}
+            # Size of what is about to be sent, before any generation starts
+            yield _sse("prompt", built["prompt_stats"])
+            async for chunk in deepseek_client.stream_chat(payload):
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices", []):
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        yield _sse("token", {"delta": delta})
+
+            ai_result = {
+                "model": SUMMARY_MODEL,
+                "summary_text": "".join(parts),
+                "tokens_used": usage,
+                "prompt_stats": built["prompt_stats"]
+            }
+            summary_doc = await run_in_threadpool(store_summary, user, upload, ai_result, analysis_package)
+            await run_in_threadpool(cache_content_summary, upload, ai_result, analysis_package)
+
+            response = summary_response(summary_doc, analysis_package)
+            finish(response)
+            done = dict(response)
+            done.pop("summary")
+            yield _sse("done", done)
+        except LLMError as e:
+            finish(error=HTTPException(status_code=500, detail=str(e)))
+            yield _sse("error", {"detail": str(e)})
+        except Exception as e:
+            finish(error=HTTPException(status_code=500, detail=f"Error creating AI summary: {str(e)}"))
+            yield _sse("error", {"detail": f"Error creating AI summary: {str(e)}"})
+        except BaseException as e:
+            # Client went away: waiters get an error, the lease is freed below
+            finish(error=HTTPException(status_code=500, detail=f"Error creating AI summary: {str(e) or type(e).__name__}"))
+            raise
+        finally:
+            if future is not None:
+                if not future.done():
+                    future.cancel()
+                _inflight_summaries.pop(key, None)
+            if leased:
+                # Shielded: a cancelled stream must still get its Mongo lease released
+                with anyio.CancelScope(shield=True):
+                    await run_in_threadpool(release_summary_lease, key, owner)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 @router.get("/analysis/summaries")
 def list_summaries(
     user: dict = Depends(get_current_user),
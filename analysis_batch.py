@@ -0,0 +1,173 @@
+import os
+import asyncio
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from pydantic import BaseModel
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+from authbadapi import get_current_user
+from rate_limiter import enforce_ai_limit, require_general_limit, AI_DAILY_LIMIT
+from analysis import generate_summary, cached_summary_response, content_cache_key
+from analysis_jobs import enqueue_summary_job, validate_webhook_url
+
+# Load .env
+load_dotenv()
+
+# MongoDB setup
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["auth_db"]
+uploads_collection = db["uploads"]
+ai_summaries_collection = db["ai_summaries"]
+summary_cache_collection = db["summary_cache"]
+ai_jobs_collection = db["ai_jobs"]
+
+# Capped at the daily AI limit: a batch of uncached files larger than that could never be charged
+AI_BATCH_MAX_FILES = min(int(os.getenv("AI_BATCH_MAX_FILES", str(AI_DAILY_LIMIT))), AI_DAILY_LIMIT)
+# Files profiled/summarised at once per batch (DeepSeek calls are also capped by LLM_MAX_CONCURRENCY)
+AI_BATCH_CONCURRENCY = int(os.getenv("AI_BATCH_CONCURRENCY", "4"))
+
+# Create router
+router = APIRouter()
+
+
+class BatchAnalysisRequest(BaseModel):
+    file_ids: List[str]
+    sampling: Optional[bool] = None
+    # "sync": wait and return summaries; "jobs": queue background jobs and return their ids
+    mode: str = "sync"
+    webhook_url: Optional[str] = None
+
+
+def _error_result(file_id: str, status_code: int, detail: str) -> dict:
+    return {
+        "file_id": file_id,
+        "status": "error",
+        "status_code": status_code,
+        "detail": detail
+    }
+
+
+async def _summarise(semaphore: asyncio.Semaphore, user: dict, upload: dict, sampling: Optional[bool]) -> dict:
+    file_id = str(upload["_id"])
+    async with semaphore:
+        try:
+            summary = await generate_summary(user, upload, sampling)
+        except HTTPException as e:
+            return _error_result(file_id, e.status_code, e.detail)
+        except Exception as e:
+            return _error_result(file_id, 500, f"Error creating AI summary: {str(e)}")
+
+    return {"status": "cached" if summary.get("cached") else "completed", **summary}
+
+
+def _plan_batch(user: dict, file_ids: List[str], object_ids: list, mode: str, results: dict):
+
+    #Blocking lookups for a batch: fills results with errors and cached summaries,
+    #returns (uploads still to summarise, DeepSeek calls they will need)
+
+    user_id = str(user["_id"])
+    uploads = {
+        str(upload["_id"]): upload
+        for upload in uploads_collection.find({"_id": {"$in": object_ids}, "user_id": user_id})
+    }
+    for file_id in file_ids:
+        if file_id not in results and file_id not in uploads:
+            results[file_id] = _error_result(file_id, 404, "Upload not found or does not belong to you")
+
+    # Tier 1: this user's own summaries, one query
+    for summary in ai_summaries_collection.find({"file_id": {"$in": list(uploads)}, "user_id": user_id}):
+        if summary["file_id"] not in results:
+            results[summary["file_id"]] = {"status": "cached", **cached_summary_response(summary)}
+
+    pending = [upload for file_id, upload in uploads.items() if file_id not in results]
+
+    # Tier 2: identical content summarised before (still needs a per-user record, but no LLM call)
+    content_keys = {content_cache_key(upload["file_hash"]) for upload in pending if upload.get("file_hash")}
+    content_cached = {
+        entry["_id"] for entry in summary_cache_collection.find({"_id": {"$in": list(content_keys)}}, {"_id": 1})
+    }
+    # Jobs mode: a file that already has a queued/running job gets that job back, at no cost
+    already_queued = set()
+    if mode == "jobs" and pending:
+        already_queued = {
+            job["file_id"]
+            for job in ai_jobs_collection.find(
+                {"user_id": user_id, "file_id": {"$in": [str(upload["_id"]) for upload in pending]}, "active": True},
+                {"file_id": 1}
+            )
+        }
+    llm_calls = sum(
+        1 for upload in pending
+        if str(upload["_id"]) not in already_queued
+        and (not upload.get("file_hash") or content_cache_key(upload["file_hash"]) not in content_cached)
+    )
+
+    return pending, llm_calls
+
+
+@router.post("/analysis/ai-summary/batch")
+async def create_ai_summary_batch(
+    request: BatchAnalysisRequest,
+    http_request: Request,
+    response: Response,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Summaries for several uploads in one call. Results come back in request order.
+    #Existing summaries are looked up with one $in query and cost nothing; every file
+    #that still needs DeepSeek counts once against the daily AI limit.
+
+    from bson import ObjectId
+
+    if request.mode not in ("sync", "jobs"):
+        raise HTTPException(status_code=400, detail="mode must be 'sync' or 'jobs'")
+
+    file_ids = list(dict.fromkeys(request.file_ids))
+    if not file_ids:
+        raise HTTPException(status_code=400, detail="file_ids must not be empty")
+    if len(file_ids) > AI_BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {AI_BATCH_MAX_FILES} files per batch"
+        )
+
+    if request.mode == "jobs":
+        # Resolves the host: keep the DNS lookup off the event loop
+        await run_in_threadpool(validate_webhook_url, request.webhook_url)
+
+    results = {}
+    object_ids = []
+    for file_id in file_ids:
+        try:
+            object_ids.append(ObjectId(file_id))
+        except Exception:
+            results[file_id] = _error_result(file_id, 400, "Invalid file_id format")
+
+    pending, llm_calls = await run_in_threadpool(_plan_batch, user, file_ids, object_ids, request.mode, results)
+
+    if llm_calls:
+        await run_in_threadpool(enforce_ai_limit, http_request, response, user, llm_calls)
+
+    if request.mode == "jobs":
+        for upload in pending:
+            job = await run_in_threadpool(enqueue_summary_job, user, upload, request.sampling, request.webhook_url)
+            results[str(upload["_id"])] = job
+    else:
+        semaphore = asyncio.Semaphore(AI_BATCH_CONCURRENCY)
+        summaries = await asyncio.gather(*[
+            _summarise(semaphore, user, upload, request.sampling) for upload in pending
+        ])
+        for summary in summaries:
+            results[summary["file_id"]] = summary
+
+    return {
+        "mode": request.mode,
+        "count": len(file_ids),
+        "ai_calls_charged": llm_calls,
+        "results": [results[file_id] for file_id in file_ids]
+    }
@@ -0,0 +1,479 @@
+import os
+import json
+import hmac
+import hashlib
+import asyncio
+import random
+import uuid
+import socket
+import ipaddress
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import urlparse
+
+import aiohttp
+import aiohttp.abc
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+from authbadapi import get_current_user
+from rate_limiter import enforce_ai_limit, require_general_limit
+from analysis import (
+    get_user_upload,
+    find_cached_summary,
+    generate_summary
+)
+
+# Load .env
+load_dotenv()
+
+# MongoDB setup
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["auth_db"]
+ai_jobs_collection = db["ai_jobs"]
+ai_summaries_collection = db["ai_summaries"]
+
+AI_JOB_WORKERS = int(os.getenv("AI_JOB_WORKERS", "2"))
+# A running job whose lease runs out (worker crashed or hung) is picked up again by another worker
+AI_JOB_LEASE_SECONDS = int(os.getenv("AI_JOB_LEASE_SECONDS", "300"))
+AI_JOB_MAX_ATTEMPTS = int(os.getenv("AI_JOB_MAX_ATTEMPTS", "3"))
+AI_JOB_RETRY_BASE_SECONDS = float(os.getenv("AI_JOB_RETRY_BASE_SECONDS", "10"))
+AI_JOB_POLL_SECONDS = float(os.getenv("AI_JOB_POLL_SECONDS", "2"))
+AI_JOB_RETENTION_SECONDS = int(os.getenv("AI_JOB_RETENTION_SECONDS", "604800"))
+# Optional: sign webhook bodies (X-BadAPI-Signature: sha256=<hex HMAC>)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_TIMEOUT_SECONDS = float(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "10"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "3"))
+
+ai_jobs_collection.create_index("purge_at", expireAfterSeconds=0)
+ai_jobs_collection.create_index([("status", 1), ("available_at", 1)])
+ai_jobs_collection.create_index([("user_id", 1), ("created_at", -1)])
+# At most one queued/running job per file and user
+ai_jobs_collection.create_index(
+    [("user_id", 1), ("file_id", 1)],
+    unique=True,
+    partialFilterExpression={"active": True}
+)
+
+# Create router
+router = APIRouter()
+
+_worker_tasks = []
+
+
+class AnalysisJobRequest(BaseModel):
+    file_id: str
+    sampling: Optional[bool] = None
+    webhook_url: Optional[str] = None
+
+
+def _job_response(job: dict) -> dict:
+    response = {
+        "job_id": str(job["_id"]),
+        "file_id": job["file_id"],
+        "status": job["status"],
+        "attempts": job.get("attempts", 0),
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+
+    if job.get("summary_id"):
+        response["summary_id"] = job["summary_id"]
+    if job.get("error"):
+        response["error"] = job["error"]
+    if job.get("webhook_url"):
+        response["webhook_status"] = job.get("webhook_status", "pending")
+
+    return response
+
+
+def _finish_job(job: dict, status: str, **fields) -> Optional[dict]:
+    # Only the worker holding the current lease may finish the job
+    now = datetime.utcnow()
+    return ai_jobs_collection.find_one_and_update(
+        {"_id": job["_id"], "lease_id": job["lease_id"]},
+        {
+            "$set": {
+                "status": status,
+                "updated_at": now,
+                "finished_at": now,
+                "purge_at": now + timedelta(seconds=AI_JOB_RETENTION_SECONDS),
+                **fields
+            },
+            "$unset": {"active": "", "lease_id": "", "lease_expires_at": ""}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _retry_job(job: dict, error: str) -> Optional[dict]:
+    delay = AI_JOB_RETRY_BASE_SECONDS * (2 ** (job["attempts"] - 1))
+    now = datetime.utcnow()
+    return ai_jobs_collection.find_one_and_update(
+        {"_id": job["_id"], "lease_id": job["lease_id"]},
+        {
+            "$set": {
+                "status": "queued",
+                "error": error,
+                "available_at": now + timedelta(seconds=random.uniform(delay / 2, delay)),
+                "updated_at": now
+            },
+            "$unset": {"lease_id": "", "lease_expires_at": ""}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def claim_job(worker_id: str) -> Optional[dict]:
+
+    #Lease the next due job: a queued one, or a running one whose lease expired.
+    #attempts is counted here, so a worker that crashes mid-job still uses up an attempt.
+
+    now = datetime.utcnow()
+    return ai_jobs_collection.find_one_and_update(
+        {
+            "attempts": {"$lt": AI_JOB_MAX_ATTEMPTS},
+            "$or": [
+                {"status": "queued", "available_at": {"$lte": now}},
+                {"status": "running", "lease_expires_at": {"$lt": now}}
+            ]
+        },
+        {
+            "$set": {
+                "status": "running",
+                "worker_id": worker_id,
+                "lease_id": uuid.uuid4().hex,
+                "lease_expires_at": now + timedelta(seconds=AI_JOB_LEASE_SECONDS),
+                "updated_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("available_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def claim_exhausted_job() -> Optional[dict]:
+    # Running jobs whose lease lapsed on their last attempt: fail them instead of retrying
+    now = datetime.utcnow()
+    return ai_jobs_collection.find_one_and_update(
+        {
+            "status": "running",
+            "lease_expires_at": {"$lt": now},
+            "attempts": {"$gte": AI_JOB_MAX_ATTEMPTS}
+        },
+        {"$set": {"lease_id": uuid.uuid4().hex, "updated_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _extend_lease(job: dict) -> bool:
+    result = ai_jobs_collection.update_one(
+        {"_id": job["_id"], "lease_id": job["lease_id"]},
+        {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=AI_JOB_LEASE_SECONDS)}}
+    )
+    return result.matched_count == 1
+
+
+async def _heartbeat(job: dict):
+    while True:
+        await asyncio.sleep(AI_JOB_LEASE_SECONDS / 3)
+        if not await run_in_threadpool(_extend_lease, job):
+            return
+
+
+async def run_job(job: dict) -> dict:
+
+    #Produce (or reuse) the summary for a job; returns the summary response.
+    #A previous attempt may have saved the summary before it crashed: generate_summary
+    #finds it (or joins a generation already in flight) so the LLM is not paid for twice.
+
+    user = {"_id": job["user_id"], "username": job["username"]}
+
+    upload = await run_in_threadpool(get_user_upload, job["file_id"], user)
+    return await generate_summary(user, upload, job.get("sampling"))
+
+
+def _webhook_body(job: dict) -> bytes:
+    payload = _job_response(job)
+    payload.pop("webhook_status", None)
+    payload["event"] = f"ai_summary.{job['status']}"
+    return json.dumps(jsonable_encoder(payload)).encode("utf-8")
+
+
+async def send_webhook(job: dict):
+
+    #POST the final job state to the client's webhook_url (best effort, a few retries)
+
+    body = _webhook_body(job)
+    headers = {"Content-Type": "application/json", "X-BadAPI-Job-Id": str(job["_id"])}
+    if WEBHOOK_SECRET:
+        signature = hmac.new(WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers["X-BadAPI-Signature"] = f"sha256={signature}"
+
+    try:
+        # The URL was checked at enqueue time, but its DNS may have changed since
+        await run_in_threadpool(validate_webhook_url, job["webhook_url"])
+    except HTTPException:
+        await run_in_threadpool(
+            ai_jobs_collection.update_one,
+            {"_id": job["_id"]},
+            {"$set": {"webhook_status": "rejected"}}
+        )
+        return
+
+    status = "failed"
+    timeout = aiohttp.ClientTimeout(total=WEBHOOK_TIMEOUT_SECONDS)
+    connector = aiohttp.TCPConnector(resolver=_PublicResolver())
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        for attempt in range(WEBHOOK_MAX_ATTEMPTS):
+            try:
+                # A redirect could point anywhere, including internal addresses
+                async with session.post(job["webhook_url"], data=body, headers=headers, allow_redirects=False) as response:
+                    if response.status < 300:
+                        status = "delivered"
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            if attempt + 1 < WEBHOOK_MAX_ATTEMPTS:
+                await asyncio.sleep(2 ** attempt)
+
+    await run_in_threadpool(
+        ai_jobs_collection.update_one,
+        {"_id": job["_id"]},
+        {"$set": {"webhook_status": status}}
+    )
+
+
+async def process_job(job: dict):
+    heartbeat = asyncio.create_task(_heartbeat(job))
+    try:
+        summary = await run_job(job)
+        finished = await run_in_threadpool(
+            _finish_job, job, "completed", summary_id=summary["summary_id"], error=None
+        )
+    except Exception as e:
+        error = e.detail if isinstance(e, HTTPException) else str(e)
+        # 4xx (upload gone, unparseable file) will not get better by retrying
+        permanent = isinstance(e, HTTPException) and e.status_code < 500
+        if permanent or job["attempts"] >= AI_JOB_MAX_ATTEMPTS:
+            finished = await run_in_threadpool(_finish_job, job, "failed", error=error)
+        else:
+            finished = None
+            await run_in_threadpool(_retry_job, job, error)
+    finally:
+        heartbeat.cancel()
+
+    if finished and finished.get("webhook_url"):
+        await send_webhook(finished)
+
+
+async def _worker(worker_id: str):
+    while True:
+        try:
+            exhausted = await run_in_threadpool(claim_exhausted_job)
+            if exhausted:
+                finished = await run_in_threadpool(
+                    _finish_job, exhausted, "failed", error=exhausted.get("error") or "Job lease expired"
+                )
+                if finished and finished.get("webhook_url"):
+                    await send_webhook(finished)
+                continue
+
+            job = await run_in_threadpool(claim_job, worker_id)
+            if not job:
+                await asyncio.sleep(AI_JOB_POLL_SECONDS)
+                continue
+
+            await process_job(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Mongo hiccup: back off and keep the worker alive
+            await asyncio.sleep(AI_JOB_POLL_SECONDS)
+
+
+def start_workers():
+    for i in range(AI_JOB_WORKERS):
+        worker_id = f"{os.getpid()}-{i}-{uuid.uuid4().hex[:8]}"
+        _worker_tasks.append(asyncio.create_task(_worker(worker_id)))
+
+
+async def stop_workers():
+    # Cancelled jobs keep their lease until it expires, then another worker retries them
+    for task in _worker_tasks:
+        task.cancel()
+    await asyncio.gather(*_worker_tasks, return_exceptions=True)
+    _worker_tasks.clear()
+
+
+def _is_public_address(address: str) -> bool:
+    # Webhooks must never reach our own network (Mongo, cloud metadata, internal services)
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if getattr(ip, "ipv4_mapped", None):
+        ip = ip.ipv4_mapped
+    # is_global is false for private, loopback, link-local, reserved, unspecified and shared (CGNAT) ranges
+    return ip.is_global and not ip.is_multicast
+
+
+def validate_webhook_url(webhook_url: Optional[str]):
+
+    #An http(s) URL whose host resolves only to public addresses.
+    #Blocking (DNS): the send path calls it through run_in_threadpool.
+
+    if not webhook_url:
+        return
+
+    try:
+        parsed = urlparse(webhook_url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="webhook_url is not a valid URL")
+    if parsed.scheme not in ("https", "http") or not parsed.hostname:
+        raise HTTPException(status_code=400, detail="webhook_url must be an http(s) URL")
+
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError):
+        raise HTTPException(status_code=400, detail="webhook_url host does not resolve")
+
+    if not all(_is_public_address(address) for address in addresses):
+        raise HTTPException(
+            status_code=400,
+            detail="webhook_url must not point to a private, loopback, link-local or reserved address"
+        )
+
+
+class _PublicResolver(aiohttp.abc.AbstractResolver):
+    # Re-checks every lookup made while sending, so DNS that changes after validation
+    # (rebinding) still can't steer the POST to an internal address
+
+    def __init__(self):
+        self._resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host: str, port: int = 0, family: socket.AddressFamily = socket.AF_INET):
+        hosts = [entry for entry in await self._resolver.resolve(host, port, family) if _is_public_address(entry["host"])]
+        if not hosts:
+            raise OSError(f"{host} resolves to no public address")
+        return hosts
+
+    async def close(self):
+        await self._resolver.close()
+
+
+def enqueue_summary_job(user: dict, upload: dict, sampling: Optional[bool] = None, webhook_url: Optional[str] = None) -> dict:
+
+    #Queue a summary job for one upload (callers charge the AI quota).
+    #Returns the job response; an already active job for the same file is returned instead.
+
+    now = datetime.utcnow()
+    job = {
+        "user_id": str(user["_id"]),
+        "username": user["username"],
+        "file_id": str(upload["_id"]),
+        "sampling": sampling,
+        "webhook_url": webhook_url,
+        "status": "queued",
+        "active": True,
+        "attempts": 0,
+        "available_at": now,
+        "created_at": now,
+        "updated_at": now
+    }
+
+    existing_summary = find_cached_summary(job["file_id"], user)
+    if existing_summary:
+        # Nothing to run: record a finished job so clients can use the same flow
+        job.update({
+            "status": "completed",
+            "summary_id": str(existing_summary["_id"]),
+            "finished_at": now,
+            "purge_at": now + timedelta(seconds=AI_JOB_RETENTION_SECONDS)
+        })
+        job.pop("active")
+
+    try:
+        result = ai_jobs_collection.insert_one(job)
+    except DuplicateKeyError:
+        # Same file already queued/running for this user: hand back that job
+        job = ai_jobs_collection.find_one({
+            "user_id": job["user_id"],
+            "file_id": job["file_id"],
+            "active": True
+        })
+        if not job:
+            raise HTTPException(status_code=409, detail="Job state changed, please retry")
+        return _job_response(job)
+
+    job["_id"] = result.inserted_id
+    return _job_response(job)
+
+
+@router.post("/analysis/jobs", status_code=202)
+def create_ai_summary_job(
+    request: AnalysisJobRequest,
+    http_request: Request,
+    response: Response,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Queue an AI summary and return immediately.
+    #The AI quota is charged here, once: worker retries never touch it.
+    #Poll GET /analysis/jobs/{job_id} or pass webhook_url to be notified.
+
+    validate_webhook_url(request.webhook_url)
+
+    upload = get_user_upload(request.file_id, user)
+
+    # Already queued/running: hand that job back without charging again (as the batch does)
+    active_job = ai_jobs_collection.find_one({
+        "user_id": str(user["_id"]),
+        "file_id": str(upload["_id"]),
+        "active": True
+    })
+    if active_job:
+        return _job_response(active_job)
+
+    enforce_ai_limit(http_request, response, user)
+
+    return enqueue_summary_job(user, upload, request.sampling, request.webhook_url)
+
+
+@router.get("/analysis/jobs/{job_id}")
+def get_ai_summary_job(
+    job_id: str,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+    from bson import ObjectId
+
+    try:
+        job = ai_jobs_collection.find_one({
+            "_id": ObjectId(job_id),
+            "user_id": str(user["_id"])
+        })
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid job_id format")
+
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    response = _job_response(job)
+
+    if job["status"] == "completed":
+        summary = ai_summaries_collection.find_one({"_id": ObjectId(job["summary_id"])})
+        if summary:
+            response.update({
+                "summary": summary["summary_text"],
+                "model": summary["model"],
+                "approximate": summary.get("approximate", False)
+            })
+
+    return response
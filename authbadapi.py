@@ -5,9 +5,13 @@ import hmac
 import hashlib
 import base64
 import json
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
 from fastapi import APIRouter, HTTPException, Header, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from pymongo import MongoClient
 from dotenv import load_dotenv
@@ -31,6 +35,12 @@ SESSION_TOKEN_SECRET = os.getenv("SESSION_TOKEN_SECRET")
 SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "86400"))
 JWT_SECRET = os.getenv("JWT_SECRET") or SESSION_TOKEN_SECRET
 JWT_TTL_SECONDS = int(os.getenv("JWT_TTL_SECONDS", "3600"))
+# bcrypt work factor for new hashes; stored hashes with another cost are rehashed on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt runs on its own small pool (it releases the GIL), so a login storm queues there
+# instead of taking the threadpool that serves every other sync endpoint
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "64"))
 
 if not API_KEY_SECRET:
     raise RuntimeError("API_KEY_SECRET not set in .env")
@@ -40,6 +50,9 @@ if not SESSION_TOKEN_SECRET:
 api_keys.create_index("key_hash", unique=True)
 sessions.create_index("expires_at", expireAfterSeconds=0)
 
+_bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_bcrypt_slots = threading.BoundedSemaphore(BCRYPT_MAX_PENDING)
+
 # Create router instead of app
 router = APIRouter()
 
@@ -53,15 +66,68 @@ class ApiKeyRequest(BaseModel):
     password: str
     replace: bool = False
 
+async def _run_bcrypt(func, *args):
+    # Bounded queue: past BCRYPT_MAX_PENDING waiting hashes, shed load instead of piling up
+    if not _bcrypt_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Too many login attempts in progress, try again shortly")
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_bcrypt_pool, func, *args)
+    finally:
+        _bcrypt_slots.release()
+
+def _hash_password(password: str) -> bytes:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
+def _needs_rehash(hashed_pw: bytes) -> bool:
+    # bcrypt hashes look like $2b$12$<salt+hash>; the middle field is the cost
+    try:
+        return int(hashed_pw.split(b"$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+def _check_password(password: str, hashed_pw: bytes):
+    # Returns (matches, new hash if the stored one used another work factor)
+    if not bcrypt.checkpw(password.encode(), hashed_pw):
+        return False, None
+    if _needs_rehash(hashed_pw):
+        return True, _hash_password(password)
+    return True, None
+
+async def _authenticate(request: Request, response: Response, username: str, password: str) -> dict:
+    # Shared by login and apikey/create: rate limit, then verify off the event loop
+    from rate_limiter import enforce_login_limit
+    await run_in_threadpool(enforce_login_limit, request, response, username)
+
+    db_user = await run_in_threadpool(users.find_one, {"username": username})
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    matches, new_hash = await _run_bcrypt(_check_password, password, db_user["password"])
+    if not matches:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    if new_hash:
+        # Only replace the hash we checked, in case the password changed meanwhile
+        await run_in_threadpool(
+            users.update_one,
+            {"_id": db_user["_id"], "password": db_user["password"]},
+            {"$set": {"password": new_hash}}
+        )
+
+    return db_user
+
 # Register
 @router.post("/user/register")
-def register(user: UserAuth):
-    if users.find_one({"username": user.username}):
+async def register(user: UserAuth, request: Request, response: Response):
+    from rate_limiter import enforce_register_limit
+    await run_in_threadpool(enforce_register_limit, request, response)
+
+    if await run_in_threadpool(users.find_one, {"username": user.username}):
         raise HTTPException(status_code=400, detail="User already exists")
 
-    hashed_pw = bcrypt.hashpw(user.password.encode(), bcrypt.gensalt())
+    hashed_pw = await _run_bcrypt(_hash_password, user.password)
 
-    users.insert_one({
+    await run_in_threadpool(users.insert_one, {
         "username": user.username,
         "password": hashed_pw,
         "api_key": None,
@@ -74,18 +140,12 @@ def register(user: UserAuth):
 
 # Login
 @router.post("/user/login")
-def login(user: UserAuth):
-    db_user = users.find_one({"username": user.username})
-
-    if not db_user or not bcrypt.checkpw(
-        user.password.encode(),
-        db_user["password"]
-    ):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+async def login(user: UserAuth, request: Request, response: Response):
+    db_user = await _authenticate(request, response, user.username, user.password)
 
     session_token = secrets.token_urlsafe(32)
     expires_at = datetime.utcnow() + timedelta(seconds=SESSION_TTL_SECONDS)
-    sessions.insert_one({
+    await run_in_threadpool(sessions.insert_one, {
         "user_id": str(db_user["_id"]),
         "token_hash": _hash_session_token(session_token),
         "created_at": datetime.utcnow(),
@@ -105,14 +165,8 @@ def login(user: UserAuth):
 
 # Create / Rotate API Key
 @router.post("/apikey/create")
-def create_api_key(data: ApiKeyRequest):
-    db_user = users.find_one({"username": data.username})
-
-    if not db_user or not bcrypt.checkpw(
-        data.password.encode(),
-        db_user["password"]
-    ):
-        raise HTTPException(status_code=401, detail="Invalid credentials")
+async def create_api_key(data: ApiKeyRequest, request: Request, response: Response):
+    db_user = await _authenticate(request, response, data.username, data.password)
 
     if db_user.get("api_key") and not data.replace:
         return {
@@ -122,7 +176,8 @@ def create_api_key(data: ApiKeyRequest):
 
     new_api_key = secrets.token_hex(32)
 
-    users.update_one(
+    await run_in_threadpool(
+        users.update_one,
         {"_id": db_user["_id"]},
         {"$set": {"api_key": new_api_key}}
     )
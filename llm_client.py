@@ -0,0 +1,155 @@
+import os
+import json
+import asyncio
+import random
+
+import aiohttp
+from dotenv import load_dotenv
+
+# Load .env
+load_dotenv()
+
+# Point DEEPSEEK_API_URL at a local fake server to exercise the client without the real API
+DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "10"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "10"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LLMError(Exception):
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class DeepSeekClient:
+    # One long-lived pooled session for the whole app (started/closed by the FastAPI lifespan):
+    # keep-alive connections and cached DNS instead of a TCP+TLS handshake per summary,
+    # explicit timeouts, a cap on concurrent calls and backoff retries on 429/5xx
+
+    def __init__(
+        self,
+        api_key: str,
+        api_url: str = DEEPSEEK_API_URL,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout_seconds: float = LLM_TIMEOUT_SECONDS,
+        connect_timeout_seconds: float = LLM_CONNECT_TIMEOUT_SECONDS,
+        max_retries: int = LLM_MAX_RETRIES,
+        retry_base_seconds: float = LLM_RETRY_BASE_SECONDS
+    ):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.max_connections = max_connections
+        self.timeout = aiohttp.ClientTimeout(total=timeout_seconds, connect=connect_timeout_seconds)
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    async def start(self):
+        if self._session and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            ttl_dns_cache=300,
+            keepalive_timeout=60
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=self.timeout,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}"
+            }
+        )
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _retry_delay(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Exponential backoff with full jitter
+        return random.uniform(0, self.retry_base_seconds * (2 ** attempt))
+
+    async def _post(self, payload: dict, timeout: aiohttp.ClientTimeout = None):
+
+        #POST with retries; returns an open 200 response the caller must release
+
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = await self._session.post(self.api_url, json=payload, timeout=timeout or self.timeout)
+                if response.status == 200:
+                    return response
+
+                async with response:
+                    error_text = await response.text()
+                if response.status not in RETRYABLE_STATUSES or attempt == self.max_retries:
+                    raise LLMError(f"DeepSeek API error: {error_text}", response.status)
+                retry_after = response.headers.get("Retry-After")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    raise LLMError(f"Failed to call DeepSeek API: {str(e)}")
+
+            await asyncio.sleep(self._retry_delay(attempt, retry_after))
+
+    async def chat(self, payload: dict) -> dict:
+
+        #POST a chat completion and return the decoded JSON response
+
+        await self.start()
+
+        async with self._semaphore:
+            response = await self._post(payload)
+            try:
+                async with response:
+                    return await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise LLMError(f"Failed to call DeepSeek API: {str(e)}")
+
+    async def stream_chat(self, payload: dict):
+
+        #POST a streaming chat completion and yield each decoded SSE chunk.
+        #Only connecting is retried: once tokens have been relayed a retry would duplicate them.
+        #No total deadline while streaming; each read waits at most LLM_TIMEOUT_SECONDS.
+
+        await self.start()
+
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=self.timeout.connect,
+            sock_read=self.timeout.total
+        )
+
+        async with self._semaphore:
+            response = await self._post({**payload, "stream": True}, timeout=timeout)
+            try:
+                async with response:
+                    async for raw_line in response.content:
+                        line = raw_line.decode("utf-8").strip()
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            return
+                        yield json.loads(data)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                raise LLMError(f"DeepSeek stream interrupted: {str(e)}")
+
+
+deepseek_client = DeepSeekClient(DEEPSEEK_API_KEY)
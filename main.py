@@ -2,11 +2,18 @@ import os
 import importlib.util
 import time
 import json
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from authbadapi import router as auth_router
 from upload import router as upload_router
+from upload_sessions import router as upload_sessions_router, start_session_sweeper, stop_session_sweeper
+from upload_bulk import router as upload_bulk_router
+from usage import router as usage_router
 from analysis import router as analysis_router  # ← ADD THIS
+from analysis_jobs import router as analysis_jobs_router, start_workers, stop_workers
+from analysis_batch import router as analysis_batch_router
+from llm_client import deepseek_client
 
 def _load_apikey_router():
     module_path = os.path.join(os.path.dirname(__file__), "apikey-handling.py")
@@ -30,7 +37,20 @@ apikey_router = _load_apikey_router()
 request_logs_module = _load_request_logs_module()
 request_logs_router = request_logs_module.router
 
-app = FastAPI(title="BadAPI 😈")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled DeepSeek session for the whole process
+    await deepseek_client.start()
+    # Background AI summary workers (see analysis_jobs.py)
+    start_workers()
+    # Periodic abort of expired upload sessions (see upload_sessions.py)
+    start_session_sweeper()
+    yield
+    await stop_session_sweeper()
+    await stop_workers()
+    await deepseek_client.close()
+
+app = FastAPI(title="BadAPI 😈", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -83,7 +103,12 @@ async def log_authenticated_requests(request: Request, call_next):
 # Include routers
 app.include_router(auth_router, tags=["Authentication"])
 app.include_router(upload_router, tags=["Data Upload"])
+app.include_router(upload_sessions_router, tags=["Data Upload"])
+app.include_router(upload_bulk_router, tags=["Data Upload"])
+app.include_router(usage_router, tags=["Data Upload"])
 app.include_router(analysis_router, tags=["AI Analysis"])  # ← ADD THIS
+app.include_router(analysis_jobs_router, tags=["AI Analysis"])
+app.include_router(analysis_batch_router, tags=["AI Analysis"])
 app.include_router(apikey_router, tags=["API Keys"])
 app.include_router(request_logs_router, tags=["Request Logs"])
 
@@ -106,12 +131,30 @@ def root():
             },
             "data": {
                 "upload": "POST /data/upload",
+                "check_upload": "POST /data/upload/check",
+                "start_resumable_upload": "POST /data/upload/sessions",
+                "upload_chunk": "PUT /data/upload/sessions/{session_id}/chunks/{chunk_number}",
+                "get_upload_session": "GET /data/upload/sessions/{session_id}",
+                "complete_resumable_upload": "POST /data/upload/sessions/{session_id}/complete",
+                "abort_resumable_upload": "DELETE /data/upload/sessions/{session_id}",
+                "start_presigned_upload": "POST /data/upload/presigned",
+                "complete_presigned_upload": "POST /data/upload/presigned/{session_id}/complete",
                 "list_uploads": "GET /data/uploads",
                 "get_upload": "GET /data/upload/{file_id}",
-                "delete_upload": "DELETE /data/upload/{file_id}"
+                "get_upload_profile": "GET /data/upload/{file_id}/profile",
+                "create_download_link": "POST /data/upload/{file_id}/link",
+                "create_download_links": "POST /data/uploads/links",
+                "download_bundle": "POST /data/uploads/bundle",
+                "delete_upload": "DELETE /data/upload/{file_id}",
+                "bulk_delete_uploads": "POST /data/uploads/delete",
+                "storage_usage": "GET /data/usage"
             },
             "analysis": {  # ← ADD THIS
                 "create_summary": "POST /analysis/ai-summary",
+                "stream_summary": "POST /analysis/ai-summary/stream",
+                "batch_summary": "POST /analysis/ai-summary/batch",
+                "create_summary_job": "POST /analysis/jobs",
+                "get_summary_job": "GET /analysis/jobs/{job_id}",
                 "list_summaries": "GET /analysis/summaries",
                 "get_summary": "GET /analysis/summary/{summary_id}"
             }
@@ -0,0 +1,182 @@
+import os
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+
+# Local cache of R2 objects. Blob keys are content-addressed (blobs/{sha256}...), so an
+# entry can never go stale; it only has to be dropped when the object is deleted.
+# Set a size to 0 to disable that tier.
+OBJECT_CACHE_MEMORY_MB = int(os.getenv("OBJECT_CACHE_MEMORY_MB", "128"))
+OBJECT_CACHE_DISK_MB = int(os.getenv("OBJECT_CACHE_DISK_MB", "1024"))
+OBJECT_CACHE_TABLE_MB = int(os.getenv("OBJECT_CACHE_TABLE_MB", "256"))
+OBJECT_CACHE_DIR = os.getenv("OBJECT_CACHE_DIR", "/tmp/badapi-object-cache")
+# Bigger objects are streamed from R2 as before instead of being cached
+OBJECT_CACHE_MAX_OBJECT_MB = int(os.getenv("OBJECT_CACHE_MAX_OBJECT_MB", "64"))
+
+
+class _LRU:
+    # Size-bounded LRU over an OrderedDict (oldest first); callers hold the cache lock
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value, size: int) -> list:
+        # Returns the evicted keys so the caller can clean up behind them
+        if size > self.max_bytes:
+            return []
+        self.pop(key)
+        self.entries[key] = (value, size)
+        self.bytes += size
+        evicted = []
+        while self.bytes > self.max_bytes:
+            old_key, (_, old_size) = self.entries.popitem(last=False)
+            self.bytes -= old_size
+            evicted.append(old_key)
+        return evicted
+
+    def pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+        return entry
+
+
+class ObjectCache:
+    # Three tiers: raw bytes in memory and on local disk, keyed by r2_key (bytes may be
+    # gzip/zstd encoded), and parsed Arrow tables in memory, keyed by file_hash so every
+    # upload of the same content shares them whatever its encoding.
+    # Thread-safe: it is used from FastAPI's worker threads. Each process keeps its own
+    # LRU index of the disk tier (files written by other workers are adopted when read),
+    # so several workers sharing OBJECT_CACHE_DIR may overshoot the disk bound a little.
+
+    def __init__(
+        self,
+        memory_mb: int = OBJECT_CACHE_MEMORY_MB,
+        disk_mb: int = OBJECT_CACHE_DISK_MB,
+        table_mb: int = OBJECT_CACHE_TABLE_MB,
+        directory: str = OBJECT_CACHE_DIR,
+        max_object_mb: int = OBJECT_CACHE_MAX_OBJECT_MB
+    ):
+        self.max_object_bytes = max_object_mb * 1024 * 1024
+        self._memory = _LRU(memory_mb * 1024 * 1024)
+        self._disk = _LRU(disk_mb * 1024 * 1024)
+        self._tables = _LRU(table_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self.directory = directory if disk_mb > 0 else None
+        if self.directory:
+            self._load_disk_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def _load_disk_index(self):
+        # Adopt files left by an earlier run (or another worker), oldest first
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            files = [entry for entry in os.scandir(self.directory) if entry.is_file()]
+        except OSError:
+            self.directory = None
+            return
+
+        for entry in sorted(files, key=lambda item: item.stat().st_mtime):
+            self._index_file(entry.path, entry.stat().st_size)
+
+    def _index_file(self, path: str, size: int):
+        # The disk LRU is keyed by path (a hash of the r2_key)
+        with self._lock:
+            evicted = self._disk.put(path, None, size)
+        for old_path in evicted:
+            if old_path != path:
+                self._remove_file(old_path)
+
+    def _remove_file(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def cacheable(self, size: int) -> bool:
+        return size <= self.max_object_bytes
+
+    def get(self, r2_key: str):
+        with self._lock:
+            entry = self._memory.get(r2_key)
+            if entry is not None:
+                return entry[0]
+            if not self.directory:
+                return None
+            path = self._path(r2_key)
+            indexed = self._disk.get(path) is not None
+
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            if indexed:
+                with self._lock:
+                    self._disk.pop(path)
+            return None
+
+        if not indexed:
+            self._index_file(path, len(data))
+
+        # Promote to memory for the next read
+        with self._lock:
+            self._memory.put(r2_key, data, len(data))
+        return data
+
+    def put(self, r2_key: str, data: bytes):
+        if not self.cacheable(len(data)):
+            return
+
+        with self._lock:
+            self._memory.put(r2_key, data, len(data))
+
+        if not self.directory:
+            return
+
+        # Write-then-rename so readers (and other workers) never see a partial file
+        path = self._path(r2_key)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            self._remove_file(temp_path)
+            return
+
+        self._index_file(path, len(data))
+
+    def get_table(self, file_hash: str):
+        with self._lock:
+            entry = self._tables.get(file_hash)
+        return entry[0] if entry is not None else None
+
+    def put_table(self, file_hash: str, table):
+        with self._lock:
+            self._tables.put(file_hash, table, table.nbytes)
+
+    def discard(self, r2_key: str, file_hash: str = None):
+        # Called when the object is deleted from R2
+        with self._lock:
+            self._memory.pop(r2_key)
+            if file_hash:
+                self._tables.pop(file_hash)
+            if not self.directory:
+                return
+            path = self._path(r2_key)
+            self._disk.pop(path)
+        self._remove_file(path)
+
+
+object_cache = ObjectCache()
@@ -0,0 +1,300 @@
+import os
+import math
+import random
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_ROW_COUNT = 10
+PROFILE_CHUNK_ROWS = int(os.getenv("PROFILE_CHUNK_ROWS", "50000"))
+QUANTILE_SKETCH_SIZE = int(os.getenv("QUANTILE_SKETCH_SIZE", "512"))
+# Numeric columns are reduced together in matrices of about this many values
+PROFILE_BLOCK_CELLS = 1 << 20
+
+
+class QuantileSketch:
+    # Approximate-quantile sketch (KLL-style compactors).
+    # Level h holds values that each stand for 2**h inputs; a full level is sorted and
+    # every other value (random offset) is promoted, so memory stays around k * log2(n / k).
+    # Exact while fewer than k values have been seen.
+
+    def __init__(self, k: int = QUANTILE_SKETCH_SIZE):
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self._random = random.Random()
+
+    def update(self, values: np.ndarray):
+        # values must already be free of NaN
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                leftover = items[len(items) - len(items) % 2:]
+                paired = items[:len(items) - len(items) % 2]
+                promoted = paired[self._random.randint(0, 1)::2]
+                self.levels[level] = leftover
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    @property
+    def is_exact(self) -> bool:
+        return len(self.levels) == 1
+
+    def quantile(self, q: float):
+        if self.count == 0:
+            return None
+        if self.is_exact:
+            return float(np.quantile(self.levels[0], q))
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([
+            np.full(len(items), 2 ** level, dtype=np.float64)
+            for level, items in enumerate(self.levels)
+        ])
+        order = np.argsort(values, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        index = int(np.searchsorted(cumulative, q * cumulative[-1]))
+        return float(values[order][min(index, len(values) - 1)])
+
+
+def _merge_dtype(current, new):
+    # Promote dtypes across chunks the way a single read_csv would infer them
+    if current is None or current == new:
+        return new
+    numeric = (
+        pd.api.types.is_numeric_dtype(current)
+        and pd.api.types.is_numeric_dtype(new)
+        and not pd.api.types.is_bool_dtype(current)
+        and not pd.api.types.is_bool_dtype(new)
+    )
+    if numeric:
+        return np.result_type(current, new)
+    return np.dtype(object)
+
+
+class _ColumnStats:
+
+    def __init__(self):
+        self.dtype = None
+        self.rows = 0
+        self.missing = 0
+        self.numeric = True
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.sketch = QuantileSketch()
+
+    def update_counts(self, rows: int, missing: int, dtype):
+        self.rows += rows
+        self.missing += missing
+        self.dtype = _merge_dtype(self.dtype, dtype)
+
+        if self.numeric and not pd.api.types.is_numeric_dtype(self.dtype):
+            # A non-numeric chunk turns the whole column into object: no statistics
+            self.numeric = False
+            self.sketch = None
+
+    def update_moments(self, n: int, chunk_mean: float, chunk_m2: float, chunk_min: float, chunk_max: float, values: np.ndarray):
+        # Chan et al. pairwise form of Welford's update: merge this chunk's (n, mean, M2)
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta * delta * self.count * n / total
+        self.count = total
+
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+        self.sketch.update(values)
+
+    def describe(self) -> dict:
+        col_info = {
+            "dtype": str(self.dtype),
+            "missing_count": self.missing,
+            "missing_percentage": round(self.missing / self.rows * 100, 2) if self.rows else 0.0
+        }
+
+        if self.numeric:
+            if self.count == 0:
+                col_info["statistics"] = {
+                    "mean": None,
+                    "median": None,
+                    "std": None,
+                    "min": None,
+                    "max": None
+                }
+            else:
+                col_info["statistics"] = {
+                    "mean": self.mean,
+                    "median": self.sketch.quantile(0.5),
+                    "std": math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float("nan"),
+                    "min": self.min,
+                    "max": self.max
+                }
+
+        return col_info
+
+
+class StreamingProfiler:
+    # Column profile built one chunk at a time: memory is bounded by the chunk,
+    # the sketches and the sample rows, never by the size of the file.
+    # Each chunk is summarised with whole-frame reductions (one isna().sum(), one reduction per
+    # statistic over each numeric dtype block); only merging the results loops over columns.
+
+    def __init__(self, sample_rows: int = SAMPLE_ROW_COUNT):
+        self.row_count = 0
+        self.columns = {}
+        self.sample_size = sample_rows
+        self.sample_rows = []
+
+    def update(self, chunk: pd.DataFrame):
+        missing = chunk.isna().sum()
+        numeric_columns = []
+        counts = []
+        for col, dtype, missing_count in zip(chunk.columns, chunk.dtypes, missing.tolist()):
+            if col not in self.columns:
+                self.columns[col] = _ColumnStats()
+            stats = self.columns[col]
+            stats.update_counts(len(chunk), int(missing_count), dtype)
+            if stats.numeric and missing_count < len(chunk):
+                numeric_columns.append(col)
+                counts.append(len(chunk) - int(missing_count))
+
+        if numeric_columns:
+            self._update_numeric(chunk[numeric_columns], counts)
+
+        self.row_count += len(chunk)
+
+        if len(self.sample_rows) < self.sample_size:
+            needed = self.sample_size - len(self.sample_rows)
+            self.sample_rows.extend(chunk.head(needed).to_dict(orient='records'))
+
+    def _update_numeric(self, block: pd.DataFrame, counts: list):
+        # pandas keeps same-dtype columns in one 2D block, so converting one dtype at a time gives
+        # a (columns x rows) float64 matrix without interleaving (a view for float64 columns).
+        # Each statistic is then one reduction over that matrix. Every column has a value here.
+        groups = {}
+        for col, dtype, count in zip(block.columns, block.dtypes, counts):
+            groups.setdefault(dtype, []).append((col, count))
+
+        # Column slices keep the matrix and its temporaries around PROFILE_BLOCK_CELLS (cache-sized)
+        width = max(1, PROFILE_BLOCK_CELLS // max(len(block), 1))
+        slices = [members[start:start + width] for members in groups.values() for start in range(0, len(members), width)]
+
+        for members in slices:
+            columns = [col for col, _ in members]
+            n = np.array([count for _, count in members], dtype=np.float64)
+            values = block[columns].to_numpy(dtype=np.float64, na_value=np.nan).T
+
+            missing = np.isnan(values) if (n < values.shape[1]).any() else None
+            filled = values if missing is None else np.where(missing, 0.0, values)
+            means = filled.sum(axis=1) / n
+            deviations = values - means[:, None]
+            if missing is not None:
+                np.copyto(deviations, 0.0, where=missing)
+            m2 = np.einsum("ij,ij->i", deviations, deviations)
+            # fmin/fmax skip NaN
+            mins = np.fmin.reduce(values, axis=1)
+            maxs = np.fmax.reduce(values, axis=1)
+
+            for i, col in enumerate(columns):
+                present = values[i] if missing is None else values[i][~missing[i]]
+                self.columns[col].update_moments(
+                    int(n[i]), float(means[i]), float(m2[i]), float(mins[i]), float(maxs[i]), present
+                )
+
+    def result(self) -> dict:
+        return {
+            "row_count": self.row_count,
+            "column_count": len(self.columns),
+            "columns": {col: stats.describe() for col, stats in self.columns.items()},
+            "sample_rows": self.sample_rows
+        }
+
+
+def profile_frame(df: pd.DataFrame, chunk_rows: int = PROFILE_CHUNK_ROWS) -> dict:
+
+    #Profile an already-parsed DataFrame in row chunks (used at ingest)
+
+    profiler = StreamingProfiler()
+    if len(df) == 0:
+        profiler.update(df)
+    for start in range(0, len(df), chunk_rows):
+        profiler.update(df.iloc[start:start + chunk_rows])
+    return profiler.result()
+
+
+def profile_csv_stream(stream, chunk_rows: int = PROFILE_CHUNK_ROWS) -> dict:
+
+    #Profile a CSV straight from a byte stream (e.g. an R2 response body).
+    #Only one chunk of rows is parsed into memory at a time.
+
+    profiler = StreamingProfiler()
+    for chunk in pd.read_csv(stream, chunksize=chunk_rows):
+        profiler.update(chunk)
+    return profiler.result()
+
+
+def profile_table(table, chunk_rows: int = PROFILE_CHUNK_ROWS) -> dict:
+
+    #Profile an in-memory Arrow table batch by batch (e.g. a cached Parquet sidecar)
+
+    profiler = StreamingProfiler()
+    for batch in table.to_batches(max_chunksize=chunk_rows):
+        profiler.update(batch.to_pandas())
+    if table.num_rows == 0:
+        profiler.update(table.to_pandas())
+    return profiler.result()
+
+
+def apply_sample_bounds(profile: dict, total_rows: int, confidence_z: float = 1.96) -> dict:
+
+    #Turn a profile of sampled rows into estimates for the whole file.
+    #Adds ~95% error bounds for missing percentages and means, and flags the package as approximate.
+
+    sampled_rows = profile["row_count"]
+    for col_info in profile["columns"].values():
+        share = col_info["missing_percentage"] / 100
+        bounds = {
+            "missing_percentage": round(
+                confidence_z * math.sqrt(share * (1 - share) / sampled_rows) * 100, 2
+            ) if sampled_rows else None
+        }
+        col_info["missing_count"] = int(round(share * total_rows))
+
+        stats = col_info.get("statistics")
+        if stats and stats["std"] is not None and math.isfinite(stats["std"]):
+            non_null = sampled_rows * (1 - share)
+            bounds["mean"] = confidence_z * stats["std"] / math.sqrt(non_null) if non_null else None
+        col_info["error_bounds"] = bounds
+
+    profile["sampling"] = {
+        "sampled_rows": sampled_rows,
+        "confidence": 0.95 if confidence_z == 1.96 else None
+    }
+    profile["row_count"] = total_rows
+    profile["approximate"] = True
+    return profile
+
+
+def json_safe(value):
+    # NaN/inf (empty std, missing sample cells) are not valid JSON; report them as null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: json_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [json_safe(item) for item in value]
+    return value
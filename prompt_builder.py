@@ -0,0 +1,173 @@
+import os
+import math
+
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", "3000"))
+PROMPT_MAX_CELL_CHARS = int(os.getenv("PROMPT_MAX_CELL_CHARS", "40"))
+PROMPT_SAMPLE_MAX_COLUMNS = int(os.getenv("PROMPT_SAMPLE_MAX_COLUMNS", "20"))
+# Rough chars-per-token for English + numbers with BPE tokenizers; no tokenizer dependency needed
+CHARS_PER_TOKEN = 4
+
+PROMPT_HEADER = "You are a data analyst. Analyze this CSV file and provide a comprehensive, insightful summary."
+
+PROMPT_INSTRUCTIONS = """Please provide:
+1. A brief overview of what this dataset represents
+2. Key insights about the data quality (missing values, data types)
+3. Statistical highlights for numeric columns
+4. Any patterns or notable observations
+5. Recommendations for data analysis or cleaning
+
+Keep the summary concise but informative."""
+
+COLUMN_TABLE_HEADER = "column|type|missing%|mean|median|std|min|max"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _number(value) -> str:
+    if value is None or (isinstance(value, float) and not math.isfinite(value)):
+        return ""
+    return f"{value:.4g}"
+
+
+def _cell(value, max_chars: int = PROMPT_MAX_CELL_CHARS) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, float):
+        return f"{value:.6g}"
+    text = str(value).replace("\n", " ").replace("|", "/")
+    if len(text) > max_chars:
+        text = text[:max_chars - 1] + "…"
+    return text
+
+
+def column_row(name: str, col_info: dict) -> str:
+    # One compact line per column: name|type|missing%|mean|median|std|min|max
+    bounds = col_info.get("error_bounds") or {}
+    missing = f"{col_info['missing_percentage']:g}"
+    if bounds.get("missing_percentage") is not None:
+        missing += f"±{bounds['missing_percentage']:g}"
+
+    cells = [_cell(name), col_info["dtype"], missing]
+    stats = col_info.get("statistics")
+    if stats and stats.get("mean") is not None:
+        mean = _number(stats["mean"])
+        if bounds.get("mean") is not None:
+            mean += f"±{_number(bounds['mean'])}"
+        cells += [mean, _number(stats["median"]), _number(stats["std"]), _number(stats["min"]), _number(stats["max"])]
+    else:
+        cells += [""] * 5
+    return "|".join(cells)
+
+
+def column_priority(col_info: dict) -> float:
+
+    #Higher means more worth the tokens.
+    #Numeric columns that actually vary carry the statistics the summary talks about;
+    #missing data is a data-quality finding; constant or empty columns say little beyond their name.
+
+    score = 1.0
+    missing = col_info["missing_percentage"]
+    if missing >= 100:
+        return 0.5
+    if missing > 0:
+        score += 1 + missing / 100
+
+    stats = col_info.get("statistics")
+    if stats and stats.get("mean") is not None:
+        std = stats.get("std")
+        if std is not None and math.isfinite(std) and std > 0:
+            score += 2
+        else:
+            score -= 0.5
+    return score
+
+
+def sample_table(sample_rows: list, columns: list, max_rows: int) -> str:
+    # Sample rows as a pipe-separated table (header line first)
+    lines = ["|".join(_cell(col) for col in columns)]
+    for row in sample_rows[:max_rows]:
+        lines.append("|".join(_cell(row.get(col)) for col in columns))
+    return "\n".join(lines)
+
+
+def build_prompt(analysis_package: dict, token_budget: int = AI_PROMPT_TOKEN_BUDGET) -> dict:
+
+    #Render the analysis package as a prompt that fits in token_budget (estimated).
+    #Columns are added in priority order until about 3/4 of the budget is used; the rest
+    #goes to sample rows. Kept columns are listed in file order and the omitted count is stated.
+    #Returns the prompt and what was included so callers can report it.
+
+    overview = (
+        f"{PROMPT_HEADER}\n\n"
+        f"Dataset Overview:\n"
+        f"- Total Rows: {analysis_package['row_count']}\n"
+        f"- Total Columns: {analysis_package['column_count']}\n"
+    )
+    if analysis_package.get("approximate"):
+        overview += (
+            f"\nNote: column statistics are estimated from a sample of "
+            f"{analysis_package['sampling']['sampled_rows']} rows.\n"
+            f"Values marked ± are 95% error bounds. Treat all statistics as approximate and say so in the summary.\n"
+        )
+
+    fixed_tokens = estimate_tokens(overview) + estimate_tokens(PROMPT_INSTRUCTIONS) + 40
+    remaining = max(token_budget - fixed_tokens, 0)
+    column_budget = remaining * 3 // 4
+
+    columns = analysis_package["columns"]
+    rows = {name: column_row(name, col_info) for name, col_info in columns.items()}
+    ranked = sorted(columns, key=lambda name: column_priority(columns[name]), reverse=True)
+
+    kept = set()
+    used = estimate_tokens(COLUMN_TABLE_HEADER)
+    for name in ranked:
+        cost = estimate_tokens(rows[name]) + 1
+        if used + cost > column_budget:
+            # Always show at least one column, however tight the budget
+            if kept:
+                continue
+        kept.add(name)
+        used += cost
+
+    kept_columns = [name for name in columns if name in kept]
+    omitted = len(columns) - len(kept_columns)
+
+    column_section = "Column Details:\n" + "\n".join([COLUMN_TABLE_HEADER] + [rows[name] for name in kept_columns])
+    if omitted:
+        column_section += f"\n({omitted} lower-priority columns omitted to fit the token budget)"
+
+    # Fill what is left with sample rows, dropping rows until it fits.
+    # Wide files: sample only the highest-priority kept columns, so a few whole rows still fit.
+    sample_rows = analysis_package.get("sample_rows") or []
+    top_columns = set([name for name in ranked if name in kept][:PROMPT_SAMPLE_MAX_COLUMNS])
+    sample_columns = [name for name in kept_columns if name in top_columns]
+    sample_budget = remaining - estimate_tokens(column_section)
+    sample_count = len(sample_rows)
+    sample_section = ""
+    while sample_count > 0:
+        table = sample_table(sample_rows, sample_columns, sample_count)
+        label = f"first {sample_count} rows"
+        if len(sample_columns) < len(kept_columns):
+            label += f", {len(sample_columns)} of the columns above"
+        sample_section = f"Sample Data ({label}):\n{table}"
+        if estimate_tokens(sample_section) <= sample_budget:
+            break
+        sample_count -= 1
+        sample_section = ""
+
+    sections = [overview, column_section]
+    if sample_section:
+        sections.append(sample_section)
+    sections.append(PROMPT_INSTRUCTIONS)
+    prompt = "\n\n".join(section.strip("\n") for section in sections)
+
+    return {
+        "prompt": prompt,
+        "estimated_tokens": estimate_tokens(prompt),
+        "token_budget": token_budget,
+        "columns_included": len(kept_columns),
+        "columns_omitted": omitted,
+        "sample_rows_included": sample_count
+    }
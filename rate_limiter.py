@@ -1,10 +1,12 @@
 import os
 import time
+import ipaddress
 from datetime import datetime, timezone
 from typing import Dict, List, Tuple
 
 from fastapi import Depends, HTTPException, Request, Response
 from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 from authbadapi import get_current_user
 # MongoDB
@@ -16,6 +18,16 @@ client = MongoClient(MONGO_URI)
 db = client["auth_db"]
 rate_limits = db["rate_limits"]
 
+# Reverse proxies whose X-Forwarded-For is honoured (comma-separated IPs or CIDRs); empty trusts none
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(proxy.strip(), strict=False)
+    for proxy in os.getenv("TRUSTED_PROXIES", "").split(",")
+    if proxy.strip()
+]
+
+# AI calls per user (or API key) per day; a batch can never need more than this
+AI_DAILY_LIMIT = 5
+
 rate_limits.create_index(
     [("key", 1), ("bucket", 1), ("window_seconds", 1), ("window_start", 1)],
     unique=True
@@ -34,39 +46,60 @@ def _rate_limit_headers(bucket: str, name: str, limit: int, remaining: int, rese
     }
 
 
+def _count_if_within(window: Dict[str, object], cost: int, max_requests: int, reset_at: int):
+    # Adds cost only while the window stays within its limit; None means it would not fit
+    update = {
+        "$inc": {"count": cost},
+        "$setOnInsert": {"reset_at": datetime.fromtimestamp(reset_at, tz=timezone.utc)}
+    }
+    conditions = {**window, "count": {"$lte": max_requests - cost}}
+    try:
+        return rate_limits.find_one_and_update(conditions, update, upsert=True, return_document=ReturnDocument.AFTER)
+    except DuplicateKeyError:
+        # The window exists but is too full (or a concurrent request just created it): retry without upsert
+        return rate_limits.find_one_and_update(conditions, update, return_document=ReturnDocument.AFTER)
+
+
 def _apply_limits(key: str, bucket: str, limits: List[Dict[str, object]]) -> Tuple[Dict[str, str], int]:
+
+    #Count one request against every window, or against none of them.
+    #A window is only incremented while the request fits, so a rejected request (e.g. a batch
+    #costing more than what is left today) spends nothing; windows already counted are given back.
+
     now_ts = int(time.time())
     headers: Dict[str, str] = {}
     retry_after = 0
+    counted = []
 
     for limit in limits:
         window_seconds = limit["window_seconds"]
         window_name = limit["name"]
         max_requests = limit["limit"]
+        # Some requests count as several (e.g. one AI call per file in a batch)
+        cost = limit.get("cost", 1)
         window_start = _window_start(now_ts, window_seconds)
         reset_at = window_start + window_seconds
+        window = {
+            "key": key,
+            "bucket": bucket,
+            "window_seconds": window_seconds,
+            "window_start": window_start
+        }
+
+        doc = _count_if_within(window, cost, max_requests, reset_at) if cost <= max_requests else None
+        if doc is not None:
+            counted.append((window, cost))
+            count = doc["count"]
+        else:
+            retry_after = max(retry_after, reset_at - now_ts)
+            count = (rate_limits.find_one(window) or {}).get("count", 0)
 
-        doc = rate_limits.find_one_and_update(
-            {
-                "key": key,
-                "bucket": bucket,
-                "window_seconds": window_seconds,
-                "window_start": window_start
-            },
-            {
-                "$inc": {"count": 1},
-                "$setOnInsert": {"reset_at": datetime.fromtimestamp(reset_at, tz=timezone.utc)}
-            },
-            upsert=True,
-            return_document=ReturnDocument.AFTER
-        )
-
-        count = doc["count"]
         remaining = max(max_requests - count, 0)
         headers.update(_rate_limit_headers(bucket, window_name, max_requests, remaining, reset_at))
 
-        if count > max_requests:
-            retry_after = max(retry_after, reset_at - now_ts)
+    if retry_after > 0:
+        for window, cost in counted:
+            rate_limits.update_one(window, {"$inc": {"count": -cost}})
 
     return headers, retry_after
 
@@ -87,6 +120,51 @@ def _enforce(response: Response, key: str, bucket: str, limits: List[Dict[str, o
         raise HTTPException(status_code=429, detail="Rate limit exceeded", headers=headers)
 
 
+def _is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+
+def client_ip(request: Request) -> str:
+    # Clients can send any X-Forwarded-For: only hops appended by our own proxies count,
+    # so walk it from the right and take the first address that isn't a trusted proxy
+    peer = request.client.host if request.client else ""
+    if not _is_trusted_proxy(peer):
+        return peer
+
+    forwarded_for = request.headers.get("x-forwarded-for", "")
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else peer
+
+
+def enforce_login_limit(request: Request, response: Response, username: str):
+    # Password checks cost real CPU (bcrypt): cap attempts per client IP and per account,
+    # counted before the hash is checked so a storm is turned away cheaply
+    ip_limits = [
+        {"name": "minute", "limit": 20, "window_seconds": 60},
+        {"name": "hour", "limit": 200, "window_seconds": 3600}
+    ]
+    username_limits = [
+        {"name": "minute", "limit": 5, "window_seconds": 60},
+        {"name": "hour", "limit": 50, "window_seconds": 3600}
+    ]
+    _enforce(response, f"ip:{client_ip(request)}", "login_ip", ip_limits)
+    _enforce(response, f"username:{username.lower()}", "login_user", username_limits)
+
+
+def enforce_register_limit(request: Request, response: Response):
+    limits = [
+        {"name": "hour", "limit": 10, "window_seconds": 3600}
+    ]
+    _enforce(response, f"ip:{client_ip(request)}", "register", limits)
+
+
 def require_general_limit(
     request: Request,
     response: Response,
@@ -101,19 +179,24 @@ def require_general_limit(
     _enforce(response, key, "general", limits)
 
 
-def require_ai_limit(
-    request: Request,
-    response: Response,
-    user: dict = Depends(get_current_user)
-):
+def enforce_ai_limit(request: Request, response: Response, user: dict, cost: int = 1):
+    # A batch is one request per minute but spends `cost` AI calls of the daily allowance
     limits = [
         {"name": "minute", "limit": 1, "window_seconds": 60},
-        {"name": "day", "limit": 5, "window_seconds": 86400}
+        {"name": "day", "limit": AI_DAILY_LIMIT, "window_seconds": 86400, "cost": cost}
     ]
     key = _auth_key_for_user(request, user)
     _enforce(response, key, "ai", limits)
 
 
+def require_ai_limit(
+    request: Request,
+    response: Response,
+    user: dict = Depends(get_current_user)
+):
+    enforce_ai_limit(request, response, user)
+
+
 def require_upload_limit(
     request: Request,
     response: Response,
@@ -126,16 +209,21 @@ def require_upload_limit(
     _enforce(response, key, "upload", limits)
 
 
+def enforce_download_link_limit(request: Request, response: Response, user: dict, cost: int = 1):
+    # Bulk link/bundle requests count one link per file
+    limits = [
+        {"name": "hour", "limit": 120, "window_seconds": 3600, "cost": cost}
+    ]
+    key = _auth_key_for_user(request, user)
+    _enforce(response, key, "download_link", limits)
+
+
 def require_download_link_limit(
     request: Request,
     response: Response,
     user: dict = Depends(get_current_user)
 ):
-    limits = [
-        {"name": "hour", "limit": 120, "window_seconds": 3600}
-    ]
-    key = _auth_key_for_user(request, user)
-    _enforce(response, key, "download_link", limits)
+    enforce_download_link_limit(request, response, user)
 
 
 def enforce_download_token_general_limit(response: Response, user_id: str):
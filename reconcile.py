@@ -0,0 +1,221 @@
+import os
+import heapq
+import argparse
+import itertools
+from datetime import datetime, timedelta, timezone
+
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from botocore.exceptions import ClientError
+
+from upload import s3_client, R2_BUCKET_NAME, delete_r2_objects
+
+# Load .env
+load_dotenv()
+
+# MongoDB setup
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["auth_db"]
+uploads_collection = db["uploads"]
+blobs_collection = db["blobs"]
+upload_sessions_collection = db["upload_sessions"]
+
+# Objects and records younger than this are skipped: an upload may sit between its
+# R2 write and its Mongo insert (or a delete between its two steps) right now
+RECONCILE_GRACE_SECONDS = int(os.getenv("RECONCILE_GRACE_SECONDS", "3600"))
+# Keys per list_objects_v2 page / per delete_objects call (1000 is the S3 maximum)
+RECONCILE_BATCH_SIZE = 1000
+
+# Sessions in these states may still own their staging object
+LIVE_SESSION_STATUSES = ["uploading", "assembling", "validating"]
+
+# The merge walks Mongo in key order, so every key field needs an index
+uploads_collection.create_index("r2_key")
+upload_sessions_collection.create_index("staging_key")
+
+
+def list_r2_objects(prefix: str):
+    # Every object under prefix in key order, one page (up to 1000 keys) in memory at a time
+    paginator = s3_client.get_paginator("list_objects_v2")
+    pages = paginator.paginate(
+        Bucket=R2_BUCKET_NAME,
+        Prefix=prefix,
+        PaginationConfig={"PageSize": RECONCILE_BATCH_SIZE}
+    )
+    for page in pages:
+        for obj in page.get("Contents", []):
+            yield obj["Key"], obj
+
+
+def legacy_upload_keys(prefix: str):
+    # users/{user_id}/{uuid}.csv objects, from uploads stored before content-addressed blobs
+    cursor = uploads_collection.find(
+        {"r2_key": {"$regex": f"^{prefix}"}},
+        {"r2_key": 1, "user_id": 1, "uploaded_at": 1}
+    ).sort("r2_key", 1).batch_size(RECONCILE_BATCH_SIZE)
+    for upload in cursor:
+        yield upload["r2_key"], {"collection": "uploads", "id": str(upload["_id"]), "created_at": upload.get("uploaded_at")}
+
+
+def blob_keys(prefix: str):
+    # blobs/{sha256}.csv[.gz|.zst] plus the optional .parquet sidecar. All hashes have the
+    # same length, so walking blobs by _id and sorting each blob's own keys is key order.
+    # Blobs with no references left don't count: their objects are orphans.
+    cursor = blobs_collection.find(
+        {"ref_count": {"$gt": 0}},
+        {"r2_key": 1, "parquet_key": 1, "created_at": 1}
+    ).sort("_id", 1).batch_size(RECONCILE_BATCH_SIZE)
+    for blob in cursor:
+        record = {"collection": "blobs", "id": blob["_id"], "created_at": blob.get("created_at")}
+        for key in sorted(key for key in (blob["r2_key"], blob.get("parquet_key")) if key):
+            yield key, record
+
+
+def staging_keys(prefix: str):
+    # staging/{user_id}/{uuid}.csv objects owned by an unfinished upload session
+    cursor = upload_sessions_collection.find(
+        {"status": {"$in": LIVE_SESSION_STATUSES}},
+        {"staging_key": 1, "created_at": 1}
+    ).sort("staging_key", 1).batch_size(RECONCILE_BATCH_SIZE)
+    for session in cursor:
+        # The client may not have sent the object yet, so a missing one is not dangling
+        yield session["staging_key"], {"collection": "upload_sessions", "id": str(session["_id"]), "optional": True}
+
+
+# prefix -> sorted (key, record) stream from Mongo
+PREFIXES = {
+    "users/": legacy_upload_keys,
+    "blobs/": blob_keys,
+    "staging/": staging_keys
+}
+
+
+def merge_keys(objects, records):
+
+    #Sorted merge of two (key, value) streams, both in ascending key order.
+    #Yields (key, object or None, record or None) per distinct key; memory is constant.
+
+    tagged = heapq.merge(
+        ((key, 0, value) for key, value in objects),
+        ((key, 1, value) for key, value in records),
+        key=lambda item: item[:2]
+    )
+    for key, group in itertools.groupby(tagged, key=lambda item: item[0]):
+        obj = record = None
+        for _, side, value in group:
+            if side == 0:
+                obj = value
+            else:
+                record = record or value
+        yield key, obj, record
+
+
+def reconcile_prefix(prefix: str, cutoff: datetime, delete: bool, stats: dict):
+    orphans = []
+
+    def flush():
+        failed = delete_r2_objects(orphans) if delete else set()
+        stats["deleted"] += len(orphans) - len(failed)
+        stats["delete_failed"] += len(failed)
+        orphans.clear()
+
+    for key, obj, record in merge_keys(list_r2_objects(prefix), PREFIXES[prefix](prefix)):
+        stats["objects"] += obj is not None
+
+        if obj is not None and record is None:
+            if obj["LastModified"] > cutoff:
+                stats["skipped_recent"] += 1
+                continue
+            stats["orphaned"] += 1
+            print(f"orphan\t{key}\t{obj['Size']}\t{obj['LastModified'].isoformat()}")
+            orphans.append(key)
+            if len(orphans) >= RECONCILE_BATCH_SIZE:
+                flush()
+
+        elif obj is None and record is not None and not record.get("optional"):
+            created_at = record.get("created_at")
+            if created_at and created_at.replace(tzinfo=timezone.utc) > cutoff:
+                stats["skipped_recent"] += 1
+                continue
+            stats["dangling"] += 1
+            print(f"dangling\t{key}\t{record['collection']}\t{record['id']}")
+
+    if orphans:
+        flush()
+
+
+def abort_stale_multipart_uploads(cutoff: datetime, delete: bool, stats: dict):
+
+    #Unfinished multipart uploads under staging/ keep their parts in R2 without showing up
+    #in list_objects_v2. Abort the ones no live session owns (e.g. the session record was
+    #purged before the app's sweep got to it, or the process died before inserting it).
+
+    paginator = s3_client.get_paginator("list_multipart_uploads")
+    for page in paginator.paginate(Bucket=R2_BUCKET_NAME, Prefix="staging/"):
+        for upload in page.get("Uploads", []):
+            stats["multipart_uploads"] = stats.get("multipart_uploads", 0) + 1
+            if upload["Initiated"] > cutoff:
+                stats["skipped_recent"] += 1
+                continue
+
+            owned = upload_sessions_collection.find_one(
+                {
+                    "staging_key": upload["Key"],
+                    "r2_upload_id": upload["UploadId"],
+                    "status": {"$in": LIVE_SESSION_STATUSES}
+                },
+                {"_id": 1}
+            )
+            if owned:
+                continue
+
+            stats["stale_multipart"] = stats.get("stale_multipart", 0) + 1
+            print(f"multipart\t{upload['Key']}\t{upload['UploadId']}\t{upload['Initiated'].isoformat()}")
+            if not delete:
+                continue
+            try:
+                s3_client.abort_multipart_upload(Bucket=R2_BUCKET_NAME, Key=upload["Key"], UploadId=upload["UploadId"])
+                stats["multipart_aborted"] = stats.get("multipart_aborted", 0) + 1
+            except ClientError:
+                stats["delete_failed"] += 1
+
+
+def purge_released_blobs(cutoff: datetime) -> int:
+    # Zero-count blob records left by a failed delete (still carrying their deleting_id claim);
+    # their objects were just handled as orphans. A later upload of the content re-creates the record.
+    released = [
+        blob["_id"]
+        for blob in blobs_collection.find({"ref_count": {"$lte": 0}, "created_at": {"$lt": cutoff}}, {"_id": 1})
+    ]
+    if released:
+        blobs_collection.delete_many({"_id": {"$in": released}, "ref_count": {"$lte": 0}})
+        db["profiles"].delete_many({"_id": {"$in": released}})
+    return len(released)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find R2 objects with no Mongo record (orphans) and records whose object is gone (dangling)"
+    )
+    parser.add_argument("--prefix", action="append", choices=sorted(PREFIXES),
+                        help="Prefix to check (repeatable; default: all)")
+    parser.add_argument("--grace-seconds", type=int, default=RECONCILE_GRACE_SECONDS,
+                        help="Skip objects and records newer than this")
+    parser.add_argument("--delete", action="store_true",
+                        help="Delete orphaned objects and abort stale multipart uploads (dangling records are only reported)")
+    args = parser.parse_args()
+
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=args.grace_seconds)
+    for prefix in args.prefix or list(PREFIXES):
+        stats = dict.fromkeys(["objects", "orphaned", "dangling", "skipped_recent", "deleted", "delete_failed"], 0)
+        reconcile_prefix(prefix, cutoff, args.delete, stats)
+        if prefix == "staging/":
+            abort_stale_multipart_uploads(cutoff, args.delete, stats)
+        if prefix == "blobs/" and args.delete:
+            stats["released_blobs_purged"] = purge_released_blobs(cutoff.replace(tzinfo=None))
+        print(f"# {prefix} " + " ".join(f"{name}={count}" for name, count in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ from typing import Optional
 from pymongo import MongoClient
 
 from authbadapi import get_current_jwt_user
+from rate_limiter import client_ip
 
 # MongoDB
 MONGO_URI = os.getenv("MONGO_URI")
@@ -34,15 +35,6 @@ class RequestLog(BaseModel):
     user_agent: Optional[str]
 
 
-def _client_ip(request: Request) -> Optional[str]:
-    forwarded_for = request.headers.get("x-forwarded-for")
-    if forwarded_for:
-        return forwarded_for.split(",")[0].strip()
-    if request.client:
-        return request.client.host
-    return None
-
-
 def log_request(auth: dict, request: Request, status_code: int, latency_ms: int, upload_id: Optional[str]):
     if not auth:
         return
@@ -56,7 +48,7 @@ def log_request(auth: dict, request: Request, status_code: int, latency_ms: int,
         "status_code": status_code,
         "latency_ms": latency_ms,
         "upload_id": upload_id,
-        "ip": _client_ip(request),
+        "ip": client_ip(request) or None,
         "user_agent": request.headers.get("user-agent")
     }
 
@@ -1,21 +1,37 @@
 import os
+import gzip
 import hashlib
 import io
-import uuid
+import random
 import hmac
 import secrets
+import json
+import base64
+import threading
+import time
+import uuid
 from datetime import datetime, timedelta
 
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Request, Response
+from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from collections import OrderedDict, Counter
+from pydantic import BaseModel
 import pandas as pd
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 import boto3
 from botocore.exceptions import ClientError
 
 # Import the authentication dependency from main file
 from authbadapi import get_current_user
+from profiling import StreamingProfiler, apply_sample_bounds, profile_frame, profile_csv_stream, profile_table, json_safe
+from object_cache import object_cache
+from usage import reserve_usage, release_usage
 from rate_limiter import (
+    client_ip,
     require_general_limit,
     require_upload_limit,
     require_download_link_limit,
@@ -31,6 +47,10 @@ client = MongoClient(MONGO_URI)
 db = client["auth_db"]
 uploads_collection = db["uploads"]
 download_tokens_collection = db["download_tokens"]
+used_download_tokens_collection = db["used_download_tokens"]
+blobs_collection = db["blobs"]
+profiles_collection = db["profiles"]
+ai_summaries_collection = db["ai_summaries"]
 
 # Cloudflare R2 setup
 R2_ACCOUNT_ID = os.getenv("R2_ACCOUNT_ID")
@@ -39,13 +59,38 @@ R2_SECRET_ACCESS_KEY = os.getenv("R2_SECRET_ACCESS_KEY")
 R2_BUCKET_NAME = os.getenv("R2_BUCKET_NAME")
 DOWNLOAD_TOKEN_SECRET = os.getenv("DOWNLOAD_TOKEN_SECRET")
 DOWNLOAD_TOKEN_TTL_SECONDS = int(os.getenv("DOWNLOAD_TOKEN_TTL_SECONDS", "60"))
+# "db": random token stored in download_tokens; "stateless": signed v1.* token, no write at link time.
+# Both formats are always accepted by /data/download/{token}, so switching modes keeps old links valid.
+DOWNLOAD_TOKEN_MODE = os.getenv("DOWNLOAD_TOKEN_MODE", "db").lower()
 R2_PRESIGN_TTL_SECONDS = int(os.getenv("R2_PRESIGN_TTL_SECONDS", "60"))
+# A cached presigned URL is reused while at least this much of its validity is left
+R2_PRESIGN_MIN_REMAINING_SECONDS = int(os.getenv("R2_PRESIGN_MIN_REMAINING_SECONDS", str(R2_PRESIGN_TTL_SECONDS // 2)))
+R2_PRESIGN_CACHE_SIZE = int(os.getenv("R2_PRESIGN_CACHE_SIZE", "10000"))
+# Default for /data/download/{token}: 302 straight to R2 instead of JSON (override with ?redirect=)
+DOWNLOAD_REDIRECT = os.getenv("DOWNLOAD_REDIRECT", "false").lower() in {"1", "true", "yes"}
 DOWNLOAD_BIND_IP = os.getenv("DOWNLOAD_BIND_IP", "false").lower() in {"1", "true", "yes"}
 DOWNLOAD_BIND_UA = os.getenv("DOWNLOAD_BIND_UA", "false").lower() in {"1", "true", "yes"}
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
 MAX_FILE_SIZE_MB = int(os.getenv("MAX_FILE_SIZE_MB", "200"))
 MAX_ROWS = int(os.getenv("MAX_ROWS", "200000"))
 MAX_COLUMNS = int(os.getenv("MAX_COLUMNS", "200"))
+# An upload of content whose blob is being deleted waits this long for the delete to finish;
+# a delete claim older than BLOB_DELETE_STALE_SECONDS is from a crashed/failed delete and is dropped
+BLOB_DELETE_WAIT_SECONDS = int(os.getenv("BLOB_DELETE_WAIT_SECONDS", "10"))
+BLOB_DELETE_STALE_SECONDS = int(os.getenv("BLOB_DELETE_STALE_SECONDS", "60"))
+PARQUET_SIDECAR_ENABLED = os.getenv("PARQUET_SIDECAR_ENABLED", "false").lower() in {"1", "true", "yes"}
+
+# Compressed uploads are stored as-is; file_hash/file_size always describe the decompressed CSV
+CSV_CONTENT_TYPES = {
+    None: "text/csv",
+    "gzip": "application/gzip",
+    "zstd": "application/zstd"
+}
+CSV_EXTENSIONS = {
+    None: ".csv",
+    "gzip": ".csv.gz",
+    "zstd": ".csv.zst"
+}
 
 if not all([R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_BUCKET_NAME]):
     raise RuntimeError("R2 credentials not set in .env - Check R2_ACCOUNT_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_BUCKET_NAME")
@@ -66,6 +111,18 @@ router = APIRouter()
 
 # TTL index for auto-cleanup of expired tokens
 download_tokens_collection.create_index("expires_at", expireAfterSeconds=0)
+# One-time use of stateless tokens: a nonce record kept only for the token lifetime
+used_download_tokens_collection.create_index("expires_at", expireAfterSeconds=0)
+uploads_collection.create_index([("user_id", 1), ("file_hash", 1)])
+# Bulk deletes find their claimed uploads by deleting_id
+uploads_collection.create_index("deleting_id", sparse=True)
+# Token cleanup on delete filters by user and object
+download_tokens_collection.create_index([("user_id", 1), ("r2_key", 1)])
+
+
+class UploadCheckRequest(BaseModel):
+    file_hash: str
+    file_size: int
 
 
 def hash_file_content(content: bytes) -> str:
@@ -73,13 +130,6 @@ def hash_file_content(content: bytes) -> str:
     return hashlib.sha256(content).hexdigest()
 
 
-def _client_ip(request: Request) -> str:
-    forwarded_for = request.headers.get("x-forwarded-for")
-    if forwarded_for:
-        return forwarded_for.split(",")[0].strip()
-    return request.client.host if request.client else ""
-
-
 def _token_hash(token: str) -> str:
     # HMAC the token so the DB never stores raw secrets
     return hmac.new(
@@ -89,36 +139,718 @@ def _token_hash(token: str) -> str:
     ).hexdigest()
 
 
-def _build_public_url(path: str) -> str:
+def build_public_url(path: str) -> str:
     if PUBLIC_BASE_URL:
         return f"{PUBLIC_BASE_URL}{path}"
     return path
 
 
-def _create_download_token(user_id: str, r2_key: str, request: Request) -> dict:
+def download_token_doc(user_id: str, r2_key: str, request: Request):
+    # (raw token, document to store); only the token's HMAC is stored
     token = secrets.token_urlsafe(32)
-    token_hash = _token_hash(token)
     expires_at = datetime.utcnow() + timedelta(seconds=DOWNLOAD_TOKEN_TTL_SECONDS)
-    client_ip = _client_ip(request)
+    ip = client_ip(request)
     user_agent = request.headers.get("user-agent", "")
 
-    download_tokens_collection.insert_one({
-        "token_hash": token_hash,
+    return token, {
+        "token_hash": _token_hash(token),
         "user_id": user_id,
         "r2_key": r2_key,
         "expires_at": expires_at,
         "used": False,
         "created_at": datetime.utcnow(),
-        "bind_ip": client_ip if DOWNLOAD_BIND_IP else None,
+        "bind_ip": ip if DOWNLOAD_BIND_IP else None,
         "bind_ua": user_agent if DOWNLOAD_BIND_UA else None
-    })
+    }
+
+
+def _create_download_token(user_id: str, r2_key: str, request: Request) -> dict:
+    token, token_doc = download_token_doc(user_id, r2_key, request)
+    download_tokens_collection.insert_one(token_doc)
 
     return {
         "token": token,
+        "expires_at": token_doc["expires_at"]
+    }
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign_token(payload: str) -> str:
+    # Separate key from _token_hash so a stored token hash can never double as a signature
+    key = hmac.new(DOWNLOAD_TOKEN_SECRET.encode("utf-8"), b"download-token-v1", hashlib.sha256).digest()
+    return _b64encode(hmac.new(key, payload.encode("ascii"), hashlib.sha256).digest())
+
+
+def create_stateless_token(user_id: str, file_id: str, r2_key: str, request: Request) -> dict:
+    # v1.<payload>.<signature>: everything needed to redeem it travels in the token.
+    # IP/UA bindings are stored as short keyed hashes rather than in clear.
+    expires_at = datetime.utcnow() + timedelta(seconds=DOWNLOAD_TOKEN_TTL_SECONDS)
+    claims = {
+        "u": user_id,
+        "f": file_id,
+        "k": r2_key,
+        "e": int(time.time()) + DOWNLOAD_TOKEN_TTL_SECONDS,
+        "n": secrets.token_urlsafe(12)
+    }
+    if DOWNLOAD_BIND_IP:
+        claims["ip"] = _token_hash(client_ip(request))[:16]
+    if DOWNLOAD_BIND_UA:
+        claims["ua"] = _token_hash(request.headers.get("user-agent", ""))[:16]
+
+    payload = "v1." + _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return {
+        "token": f"{payload}.{_sign_token(payload)}",
         "expires_at": expires_at
     }
 
 
+def _verify_stateless_token(token: str) -> dict:
+    # Real tokens are base64url: anything else would break the ASCII signing/compare below
+    if not token.isascii():
+        raise HTTPException(status_code=404, detail="Download token not found")
+    payload, _, signature = token.rpartition(".")
+    if not payload.startswith("v1.") or not hmac.compare_digest(signature, _sign_token(payload)):
+        raise HTTPException(status_code=404, detail="Download token not found")
+    try:
+        return json.loads(_b64decode(payload[len("v1."):]))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Download token not found")
+
+
+class _UsedTokenSet:
+    # Per-process memory of redeemed nonces, pruned as they expire. It rejects replays
+    # without a round trip; Mongo (used_download_tokens, unique _id) is the cross-worker truth.
+
+    def __init__(self):
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, nonce: str) -> bool:
+        with self._lock:
+            return nonce in self._expiry
+
+    def add(self, nonce: str, expires_ts: int):
+        now = time.time()
+        with self._lock:
+            self._expiry[nonce] = expires_ts
+            if len(self._expiry) > 1000:
+                self._expiry = {key: ts for key, ts in self._expiry.items() if ts > now}
+
+
+_used_stateless_tokens = _UsedTokenSet()
+
+
+def _redeem_stateless_token(claims: dict) -> bool:
+    # True the first time a nonce is redeemed, False on replay
+    nonce = claims["n"]
+    if nonce in _used_stateless_tokens:
+        return False
+    try:
+        used_download_tokens_collection.insert_one({
+            "_id": nonce,
+            "user_id": claims["u"],
+            "expires_at": datetime.utcfromtimestamp(claims["e"])
+        })
+    except DuplicateKeyError:
+        _used_stateless_tokens.add(nonce, claims["e"])
+        return False
+    _used_stateless_tokens.add(nonce, claims["e"])
+    return True
+
+
+def detect_csv_encoding(filename: str, content_encoding: str = None):
+    # None for plain CSV, "gzip"/"zstd" for compressed uploads
+    name = filename.lower()
+    if name.endswith(".csv.gz"):
+        return "gzip"
+    if name.endswith(".csv.zst"):
+        return "zstd"
+    if not name.endswith(".csv"):
+        raise HTTPException(
+            status_code=400,
+            detail="File must be a CSV (.csv, .csv.gz or .csv.zst)"
+        )
+
+    encoding = (content_encoding or "").strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return "gzip"
+    if encoding == "zstd":
+        return "zstd"
+    raise HTTPException(
+        status_code=415,
+        detail=f"Unsupported Content-Encoding: {content_encoding}"
+    )
+
+
+def open_decompressed(stream, content_encoding: str = None):
+    # Streaming decompression: callers read the CSV without inflating it all up front
+    if content_encoding == "gzip":
+        return gzip.GzipFile(fileobj=stream, mode="rb")
+    if content_encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    return stream
+
+
+def _blob_key(file_hash: str, content_encoding: str = None) -> str:
+    return f"blobs/{file_hash}{CSV_EXTENSIONS[content_encoding]}"
+
+
+def _wait_for_blob_delete(file_hash: str):
+    # A release claimed this blob for deletion (deleting_id set) and may still be removing its
+    # R2 object: writing the same key now could be deleted right behind us, so wait it out
+    deadline = time.monotonic() + BLOB_DELETE_WAIT_SECONDS
+    while True:
+        blob = blobs_collection.find_one({"_id": file_hash, "deleting_id": {"$exists": True}}, {"deleting_id": 1, "deleting_at": 1})
+        if not blob:
+            return
+        if blob["deleting_at"] < datetime.utcnow() - timedelta(seconds=BLOB_DELETE_STALE_SECONDS):
+            # The delete died half-way; the object may or may not exist, so it is written again
+            blobs_collection.delete_one({"_id": file_hash, "deleting_id": blob["deleting_id"]})
+            return
+        if time.monotonic() > deadline:
+            raise HTTPException(
+                status_code=503,
+                detail="This file's storage is being cleaned up, please retry shortly"
+            )
+        time.sleep(0.2)
+
+
+def acquire_blob(file_hash: str, file_size: int, contents: bytes = None, copy_from: str = None, content_encoding: str = None) -> dict:
+    # Content-addressed storage: identical files share one R2 object across users.
+    # New content comes either as bytes or as an already-stored object to copy server-side.
+    # If the content is already stored (possibly in another encoding) that copy is reused.
+    while True:
+        blob = blobs_collection.find_one_and_update(
+            {"_id": file_hash, "ref_count": {"$gt": 0}},
+            {"$inc": {"ref_count": 1}}
+        )
+        if blob:
+            return blob
+
+        _wait_for_blob_delete(file_hash)
+
+        r2_key = _blob_key(file_hash, content_encoding)
+        try:
+            if copy_from:
+                s3_client.copy_object(
+                    Bucket=R2_BUCKET_NAME,
+                    Key=r2_key,
+                    CopySource={"Bucket": R2_BUCKET_NAME, "Key": copy_from},
+                    ContentType=CSV_CONTENT_TYPES[content_encoding],
+                    Metadata={
+                        'file_hash': file_hash
+                    },
+                    MetadataDirective='REPLACE'
+                )
+            else:
+                s3_client.put_object(
+                    Bucket=R2_BUCKET_NAME,
+                    Key=r2_key,
+                    Body=contents,
+                    ContentType=CSV_CONTENT_TYPES[content_encoding],
+                    Metadata={
+                        'file_hash': file_hash
+                    }
+                )
+                # Write-through: a summary right after the upload reads it locally
+                object_cache.put(r2_key, contents)
+        except ClientError as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to upload to R2: {str(e)}"
+            )
+
+        try:
+            # Never re-reference a blob claimed for deletion: its delete may remove what we just wrote
+            return blobs_collection.find_one_and_update(
+                {"_id": file_hash, "deleting_id": {"$exists": False}},
+                {
+                    "$inc": {"ref_count": 1},
+                    "$setOnInsert": {
+                        "r2_key": r2_key,
+                        "content_encoding": content_encoding,
+                        "file_size": file_size,
+                        "created_at": datetime.utcnow()
+                    }
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # A delete claimed the blob after our write: wait for it, then write again
+            continue
+
+
+def _delete_claimed_blobs(deleting_id: str, blobs: list):
+    # Delete the R2 objects of blobs this release claimed, then their records.
+    # A blob whose objects failed to delete keeps its claim; it goes stale for uploads
+    # (see _wait_for_blob_delete) and reconcile.py removes the objects and the record.
+    keys = [key for blob in blobs for key in (blob["r2_key"], blob.get("parquet_key")) if key]
+    failed = delete_r2_objects(keys)
+
+    for blob in blobs:
+        object_cache.discard(blob["r2_key"], blob["_id"])
+    gone = [blob["_id"] for blob in blobs if not {blob["r2_key"], blob.get("parquet_key")} & failed]
+    if gone:
+        blobs_collection.delete_many({"_id": {"$in": gone}, "deleting_id": deleting_id})
+        profiles_collection.delete_many({"_id": {"$in": gone}})
+
+
+def release_blob(file_hash: str):
+    blob = blobs_collection.find_one_and_update(
+        {"_id": file_hash},
+        {"$inc": {"ref_count": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not blob or blob["ref_count"] > 0:
+        return
+
+    # Last reference is gone. Claim the delete before touching R2: an upload of the same
+    # content either re-referenced the blob first (the claim fails) or waits for the claim
+    # to clear before writing the object again (acquire_blob)
+    deleting_id = uuid.uuid4().hex
+    blob = blobs_collection.find_one_and_update(
+        {"_id": file_hash, "ref_count": {"$lte": 0}, "deleting_id": {"$exists": False}},
+        {"$set": {"deleting_id": deleting_id, "deleting_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if blob:
+        _delete_claimed_blobs(deleting_id, [blob])
+
+
+def delete_r2_objects(keys: list) -> set:
+    # Batched delete: one R2 call per 1000 keys (the S3 API limit). Returns the keys that failed.
+    failed = set()
+    for start in range(0, len(keys), 1000):
+        batch = keys[start:start + 1000]
+        try:
+            result = s3_client.delete_objects(
+                Bucket=R2_BUCKET_NAME,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+            )
+        except ClientError:
+            failed.update(batch)
+            continue
+        failed.update(error["Key"] for error in result.get("Errors", []))
+
+    for key in keys:
+        if key not in failed:
+            object_cache.discard(key)
+            _presigned_urls.discard(key)
+    return failed
+
+
+def release_blobs(references: Counter):
+
+    #Bulk release_blob: drop {file_hash: count} references in one bulk write, then claim
+    #and delete every blob that reached zero with batched R2 deletes.
+
+    if not references:
+        return
+
+    blobs_collection.bulk_write(
+        [UpdateOne({"_id": file_hash}, {"$inc": {"ref_count": -count}}) for file_hash, count in references.items()],
+        ordered=False
+    )
+
+    deleting_id = uuid.uuid4().hex
+    blobs_collection.update_many(
+        {"_id": {"$in": list(references)}, "ref_count": {"$lte": 0}, "deleting_id": {"$exists": False}},
+        {"$set": {"deleting_id": deleting_id, "deleting_at": datetime.utcnow()}}
+    )
+    claimed = list(blobs_collection.find({"_id": {"$in": list(references)}, "deleting_id": deleting_id}))
+    if claimed:
+        _delete_claimed_blobs(deleting_id, claimed)
+
+
+def cleanup_deleted_uploads(user_id: str, uploads: list):
+
+    #Storage and cascade cleanup for upload records that were already removed:
+    #R2 objects (via blob references), AI summaries and download tokens.
+    #Slow part of a bulk delete; runs as a background task.
+
+    release_blobs(Counter(upload["blob_id"] for upload in uploads if upload.get("blob_id")))
+    delete_r2_objects([upload["r2_key"] for upload in uploads if not upload.get("blob_id")])
+
+    ai_summaries_collection.delete_many({
+        "user_id": user_id,
+        "file_id": {"$in": [str(upload["_id"]) for upload in uploads]}
+    })
+    download_tokens_collection.delete_many({
+        "user_id": user_id,
+        "r2_key": {"$in": [upload["r2_key"] for upload in uploads]}
+    })
+
+
+def store_profile(file_hash: str, profile: dict):
+    # Profiles are keyed by content like blobs. Column names may contain "." or "$",
+    # so columns and sample rows are stored as lists rather than as document keys.
+    names = list(profile["columns"].keys())
+    profiles_collection.update_one(
+        {"_id": file_hash},
+        {"$setOnInsert": {
+            "row_count": profile["row_count"],
+            "column_count": profile["column_count"],
+            "columns": [{"name": str(name), **profile["columns"][name]} for name in names],
+            "sample_columns": [str(name) for name in names],
+            "sample_rows": [[row.get(name) for name in names] for row in profile["sample_rows"]],
+            "created_at": datetime.utcnow()
+        }},
+        upsert=True
+    )
+
+
+def read_object(r2_key: str) -> bytes:
+    # Whole object, from the local cache when possible (fills it on a miss)
+    data = object_cache.get(r2_key)
+    if data is None:
+        response = s3_client.get_object(
+            Bucket=R2_BUCKET_NAME,
+            Key=r2_key
+        )
+        data = response['Body'].read()
+        object_cache.put(r2_key, data)
+    return data
+
+
+def open_object(r2_key: str):
+    # Readable stream of an object: cached bytes, or the R2 body (buffered into the
+    # cache first when the object is small enough to keep, streamed otherwise)
+    data = object_cache.get(r2_key)
+    if data is not None:
+        return io.BytesIO(data)
+
+    response = s3_client.get_object(
+        Bucket=R2_BUCKET_NAME,
+        Key=r2_key
+    )
+    if not object_cache.cacheable(response['ContentLength']):
+        return response['Body']
+
+    data = response['Body'].read()
+    object_cache.put(r2_key, data)
+    return io.BytesIO(data)
+
+
+def load_parquet_table(upload: dict):
+    # Parsed Arrow table of the Parquet sidecar, shared in memory by every upload of the content
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = object_cache.get_table(upload["file_hash"])
+    if table is None:
+        table = pq.read_table(pa.BufferReader(read_object(upload["parquet_key"])))
+        object_cache.put_table(upload["file_hash"], table)
+    return table
+
+
+def profile_upload(upload: dict) -> dict:
+
+    #Profile an upload by streaming it from R2 in row chunks, so memory stays
+    #bounded by PROFILE_CHUNK_ROWS instead of the file size.
+    #Recently uploaded/read objects come from the local object cache instead.
+
+    parquet_key = upload.get("parquet_key")
+    try:
+        if parquet_key:
+            # Parquet needs random access; the compressed sidecar is small next to the CSV
+            table = load_parquet_table(upload)
+        else:
+            stream = open_object(upload["r2_key"])
+    except ClientError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to download file from R2: {str(e)}"
+        )
+
+    try:
+        if parquet_key:
+            return profile_table(table)
+        return profile_csv_stream(open_decompressed(stream, upload.get("content_encoding")))
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Failed to parse CSV: {str(e)}"
+        )
+
+
+def _read_range(r2_key: str, start: int, end: int) -> bytes:
+    cached = object_cache.get(r2_key)
+    if cached is not None:
+        return cached[start:end + 1]
+
+    response = s3_client.get_object(
+        Bucket=R2_BUCKET_NAME,
+        Key=r2_key,
+        Range=f"bytes={start}-{end}"
+    )
+    return response['Body'].read()
+
+
+def sample_upload(upload: dict, blocks: int, block_bytes: int):
+
+    #Approximate profile from a few R2 range reads: the head of the file (header + first rows)
+    #and one randomly placed block per stratum of the rest. Cost is constant in the file size.
+    #Returns None when the file can't be sampled this way (compressed, small, or unparseable).
+
+    object_size = upload["file_size"]
+    if upload.get("content_encoding") or object_size <= block_bytes * (blocks + 1):
+        return None
+
+    try:
+        head = _read_range(upload["r2_key"], 0, block_bytes - 1)
+        header, _, head_rows = head.partition(b"\n")
+        profiler = StreamingProfiler()
+        # Drop the partial last line of each block; interior blocks also drop their partial first line
+        profiler.update(pd.read_csv(io.BytesIO(header + b"\n" + head_rows[:head_rows.rfind(b"\n") + 1])))
+
+        stratum = (object_size - block_bytes) // blocks
+        for index in range(blocks):
+            start = block_bytes + index * stratum + random.randint(0, max(stratum - block_bytes, 0))
+            data = _read_range(upload["r2_key"], start, min(start + block_bytes, object_size) - 1)
+            data = data[data.find(b"\n") + 1:data.rfind(b"\n") + 1]
+            if data:
+                profiler.update(pd.read_csv(io.BytesIO(header + b"\n" + data)))
+    except (ClientError, pd.errors.ParserError, ValueError):
+        # e.g. quoted fields spanning lines; the caller falls back to a full streaming profile
+        return None
+
+    sampled = profiler.result()
+    if sampled["column_count"] != upload["column_count"] or not sampled["row_count"]:
+        return None
+
+    profile = apply_sample_bounds(sampled, upload["row_count"])
+    profile["sampling"].update({
+        "method": "r2_range_blocks",
+        "blocks": blocks + 1,
+        "block_bytes": block_bytes
+    })
+    return profile
+
+
+def load_profile(file_hash: str):
+    # Returns the profile in profile_frame shape, or None if not profiled yet
+    doc = profiles_collection.find_one({"_id": file_hash})
+    if not doc:
+        return None
+
+    return {
+        "row_count": doc["row_count"],
+        "column_count": doc["column_count"],
+        "columns": {
+            col["name"]: {key: value for key, value in col.items() if key != "name"}
+            for col in doc["columns"]
+        },
+        "sample_rows": [dict(zip(doc["sample_columns"], row)) for row in doc["sample_rows"]]
+    }
+
+
+class HashingReader(io.RawIOBase):
+    # Hashes and counts bytes as the CSV parser pulls them from a stream,
+    # so large objects are validated and hashed in a single pass
+
+    def __init__(self, stream, max_bytes: int = None):
+        self._stream = stream
+        self._hasher = hashlib.sha256()
+        self._max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        data = self._stream.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        self._hasher.update(data)
+        self.bytes_read += size
+        if self._max_bytes is not None and self.bytes_read > self._max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large. Max size is {MAX_FILE_SIZE_MB} MB"
+            )
+        return size
+
+    def drain(self):
+        # The parser may stop before EOF; the hash has to cover every byte
+        buffer = bytearray(1024 * 1024)
+        while self.readinto(buffer):
+            pass
+
+    def hexdigest(self) -> str:
+        return self._hasher.hexdigest()
+
+
+def scan_csv(stream, content_encoding: str = None):
+    # Decompress, hash and validate in one streaming pass.
+    # Returns (df, file_hash, file_size) where hash and size describe the decompressed CSV.
+    reader = HashingReader(
+        open_decompressed(stream, content_encoding),
+        max_bytes=MAX_FILE_SIZE_MB * 1024 * 1024
+    )
+    df = load_csv(io.BufferedReader(reader))
+    try:
+        reader.drain()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid CSV file: {str(e)}"
+        )
+    return df, reader.hexdigest(), reader.bytes_read
+
+
+def load_csv(source) -> pd.DataFrame:
+    # Parse CSV to validate it and enforce the row/column caps
+    try:
+        df = pd.read_csv(source)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid CSV file: {str(e)}"
+        )
+
+    if len(df) > MAX_ROWS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many rows. Max is {MAX_ROWS}"
+        )
+
+    if len(df.columns) > MAX_COLUMNS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many columns. Max is {MAX_COLUMNS}"
+        )
+
+    return df
+
+
+def _write_parquet_sidecar(blob: dict, df: pd.DataFrame):
+    # Typed, compressed columnar copy stored next to the CSV so readers can skip re-parsing.
+    # Best effort: columns pyarrow can't type (e.g. mixed objects) just mean no sidecar.
+    if blob.get("parquet_key"):
+        return blob["parquet_key"]
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    parquet_key = f"blobs/{blob['_id']}.parquet"
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        buffer = pa.BufferOutputStream()
+        pq.write_table(table, buffer, compression="zstd")
+        data = buffer.getvalue().to_pybytes()
+        s3_client.put_object(
+            Bucket=R2_BUCKET_NAME,
+            Key=parquet_key,
+            Body=data,
+            ContentType='application/vnd.apache.parquet',
+            Metadata={
+                'file_hash': blob["_id"]
+            }
+        )
+    except (pa.ArrowException, ClientError):
+        return None
+
+    object_cache.put(parquet_key, data)
+    object_cache.put_table(blob["_id"], table)
+
+    blobs_collection.update_one(
+        {"_id": blob["_id"]},
+        {"$set": {"parquet_key": parquet_key}}
+    )
+    return parquet_key
+
+
+def store_upload(user: dict, filename: str, blob: dict, file_size: int, df: pd.DataFrame) -> dict:
+    # Store metadata ONLY in MongoDB (no file_content)
+    file_hash = blob["_id"]
+    upload_doc = {
+        "user_id": str(user["_id"]),
+        "username": user["username"],
+        "filename": filename,
+        "r2_key": blob["r2_key"],
+        "blob_id": file_hash,
+        "file_hash": file_hash,
+        "content_encoding": blob.get("content_encoding"),
+        "parquet_key": blob.get("parquet_key"),
+        "file_size": file_size,
+        "row_count": len(df),
+        "column_count": len(df.columns),
+        "columns": [str(col).strip() for col in df.columns],  # Strip whitespace from headers
+        "uploaded_at": datetime.utcnow()
+    }
+
+    try:
+        # Inside the try: anything the sidecar write raises must still release the blob reference
+        if PARQUET_SIDECAR_ENABLED:
+            upload_doc["parquet_key"] = _write_parquet_sidecar(blob, df)
+        # Profile in the same ingest pass so summaries never need to re-download the file
+        if not profiles_collection.find_one({"_id": file_hash}, {"_id": 1}):
+            store_profile(file_hash, profile_frame(df))
+        uploads_collection.insert_one(upload_doc)
+    except Exception:
+        release_blob(file_hash)
+        raise
+
+    return upload_doc
+
+
+def find_existing_upload(user: dict, file_hash: str):
+    # Check if this exact file was already uploaded by this user
+    return uploads_collection.find_one({
+        "file_hash": file_hash,
+        "user_id": str(user["_id"])
+    })
+
+
+def existing_upload_response(user: dict, existing_file: dict, request: Request) -> dict:
+    token_info = _create_download_token(str(user["_id"]), existing_file["r2_key"], request)
+    return {
+        "message": "File already uploaded",
+        "file_id": str(existing_file["_id"]),
+        "file_hash": existing_file["file_hash"],
+        "r2_key": existing_file["r2_key"],
+        "uploaded_at": existing_file["uploaded_at"],
+        "download_token": token_info["token"],
+        "download_token_expires_at": token_info["expires_at"],
+        "download_link": build_public_url(f"/data/download/{token_info['token']}")
+    }
+
+
+def upload_response(user: dict, upload_doc: dict, request: Request) -> dict:
+    token_info = _create_download_token(str(user["_id"]), upload_doc["r2_key"], request)
+    return {
+        "message": "File uploaded successfully to R2",
+        "file_id": str(upload_doc["_id"]),
+        "file_hash": upload_doc["file_hash"],
+        "filename": upload_doc["filename"],
+        "r2_key": upload_doc["r2_key"],
+        "content_encoding": upload_doc.get("content_encoding"),
+        "file_size": upload_doc["file_size"],
+        "row_count": upload_doc["row_count"],
+        "column_count": upload_doc["column_count"],
+        "columns": upload_doc["columns"],
+        "uploaded_at": upload_doc["uploaded_at"],
+        "download_token": token_info["token"],
+        "download_token_expires_at": token_info["expires_at"],
+        "download_link": build_public_url(f"/data/download/{token_info['token']}")
+    }
+
+
 def _generate_presigned_url(r2_key: str) -> str:
     return s3_client.generate_presigned_url(
         "get_object",
@@ -131,6 +863,116 @@ def _generate_presigned_url(r2_key: str) -> str:
     )
 
 
+class _PresignedUrlCache:
+    # r2_key -> (url, expires_ts), LRU-bounded. Anyone redeeming a token for the key could
+    # get a fresh URL for it anyway, so sharing one within its validity grants nothing new.
+
+    def __init__(self, max_entries: int = R2_PRESIGN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, r2_key: str):
+        # (url, seconds left) while at least R2_PRESIGN_MIN_REMAINING_SECONDS remain, else a fresh one
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(r2_key)
+            if entry and entry[1] - now >= R2_PRESIGN_MIN_REMAINING_SECONDS:
+                self._entries.move_to_end(r2_key)
+                return entry[0], int(entry[1] - now)
+
+        url = _generate_presigned_url(r2_key)
+        with self._lock:
+            self._entries[r2_key] = (url, now + R2_PRESIGN_TTL_SECONDS)
+            self._entries.move_to_end(r2_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return url, R2_PRESIGN_TTL_SECONDS
+
+    def discard(self, r2_key: str):
+        with self._lock:
+            self._entries.pop(r2_key, None)
+
+
+_presigned_urls = _PresignedUrlCache()
+
+
+@router.post("/data/upload/check")
+def check_upload(
+    data: UploadCheckRequest,
+    request: Request,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit),
+    # A hit issues a download token, like /data/upload/{file_id}/link
+    _download_link_limit: None = Depends(require_download_link_limit)
+):
+
+    #Pre-flight dedup: lets clients skip sending bytes the server already has
+
+    file_hash = data.file_hash.strip().lower()
+    if len(file_hash) != 64 or any(c not in "0123456789abcdef" for c in file_hash):
+        raise HTTPException(
+            status_code=400,
+            detail="file_hash must be a hex SHA-256 digest"
+        )
+
+    if data.file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Max size is {MAX_FILE_SIZE_MB} MB"
+        )
+
+    existing_file = find_existing_upload(user, file_hash)
+
+    if not existing_file or existing_file["file_size"] != data.file_size:
+        return {
+            "exists": False,
+            "file_hash": file_hash
+        }
+
+    return {
+        "exists": True,
+        **existing_upload_response(user, existing_file, request)
+    }
+
+
+def _ingest_upload_contents(request: Request, user: dict, filename: str, contents: bytes, content_encoding: Optional[str]):
+
+    #Blocking part of /data/upload (parsing, Mongo, R2; acquire_blob may wait on a blob delete).
+    #Runs in the threadpool so it never stalls the event loop.
+
+    if content_encoding:
+        # Compressed: hash and validate the decompressed stream in one pass
+        df, file_hash, file_size = scan_csv(io.BytesIO(contents), content_encoding)
+    else:
+        # Generate file hash
+        file_hash = hash_file_content(contents)
+        file_size = len(contents)
+        df = None
+    
+    # Check if this exact file was already uploaded by this user
+    existing_file = find_existing_upload(user, file_hash)
+    
+    if existing_file:
+        return existing_upload_response(user, existing_file, request)
+    
+    # Parse CSV to validate it and extract metadata
+    if df is None:
+        df = load_csv(io.BytesIO(contents))
+    
+    # Count it against the storage quota before anything is written to R2
+    reserve_usage(str(user["_id"]), file_size, len(df))
+    try:
+        # Shared R2 object keyed by content: blobs/{file_hash}.csv[.gz|.zst]
+        blob = acquire_blob(file_hash, file_size, contents=contents, content_encoding=content_encoding)
+        upload_doc = store_upload(user, filename, blob, file_size, df)
+    except Exception:
+        release_usage(str(user["_id"]), file_size, len(df))
+        raise
+    
+    return upload_response(user, upload_doc, request)
+
+
 @router.post("/data/upload")
 async def upload_csv(
     request: Request,
@@ -146,126 +988,20 @@ async def upload_csv(
         #Authorization: Bearer <your_api_key>
     
     
-    # Validate file type
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(
-            status_code=400,
-            detail="File must be a CSV"
-        )
+    # Validate file type (.csv, .csv.gz, .csv.zst or a Content-Encoding on the part)
+    content_encoding = detect_csv_encoding(file.filename, file.headers.get("content-encoding"))
     
     try:
         # Read file content ONCE into memory
         contents = await file.read()
-        
-        # Generate file hash
-        file_hash = hash_file_content(contents)
-        file_size = len(contents)
 
-        if file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+        if len(contents) > MAX_FILE_SIZE_MB * 1024 * 1024:
             raise HTTPException(
                 status_code=413,
                 detail=f"File too large. Max size is {MAX_FILE_SIZE_MB} MB"
             )
         
-        # Check if this exact file was already uploaded by this user
-        existing_file = uploads_collection.find_one({
-            "file_hash": file_hash,
-            "user_id": str(user["_id"])
-        })
-        
-        if existing_file:
-            token_info = _create_download_token(str(user["_id"]), existing_file["r2_key"], request)
-            return {
-                "message": "File already uploaded",
-                "file_id": str(existing_file["_id"]),
-                "file_hash": file_hash,
-                "r2_key": existing_file["r2_key"],
-                "uploaded_at": existing_file["uploaded_at"],
-                "download_token": token_info["token"],
-                "download_token_expires_at": token_info["expires_at"],
-                "download_link": _build_public_url(f"/data/download/{token_info['token']}")
-            }
-        
-        # Parse CSV to validate it and extract metadata
-        try:
-            df = pd.read_csv(io.BytesIO(contents))
-            row_count = len(df)
-            column_count = len(df.columns)
-            columns = [str(col).strip() for col in df.columns]  # Strip whitespace from headers
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Invalid CSV file: {str(e)}"
-            )
-
-        if row_count > MAX_ROWS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Too many rows. Max is {MAX_ROWS}"
-            )
-
-        if column_count > MAX_COLUMNS:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Too many columns. Max is {MAX_COLUMNS}"
-            )
-        
-        # Generate R2 key: users/{user_id}/{uuid}.csv
-        file_uuid = str(uuid.uuid4())
-        r2_key = f"users/{user['_id']}/{file_uuid}.csv"
-        
-        # Upload to Cloudflare R2
-        try:
-            s3_client.put_object(
-                Bucket=R2_BUCKET_NAME,
-                Key=r2_key,
-                Body=contents,
-                ContentType='text/csv',
-                Metadata={
-                    'original_filename': file.filename,
-                    'user_id': str(user["_id"]),
-                    'file_hash': file_hash
-                }
-            )
-        except ClientError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to upload to R2: {str(e)}"
-            )
-        
-        # Store metadata ONLY in MongoDB (no file_content)
-        upload_doc = {
-            "user_id": str(user["_id"]),
-            "username": user["username"],
-            "filename": file.filename,
-            "r2_key": r2_key,
-            "file_hash": file_hash,
-            "file_size": file_size,
-            "row_count": row_count,
-            "column_count": column_count,
-            "columns": columns,
-            "uploaded_at": datetime.utcnow()
-        }
-        
-
-        result = uploads_collection.insert_one(upload_doc)
-        token_info = _create_download_token(str(user["_id"]), r2_key, request)
-        
-        return {
-            "message": "File uploaded successfully to R2",
-            "file_id": str(result.inserted_id),
-            "file_hash": file_hash,
-            "filename": file.filename,
-            "r2_key": r2_key,
-            "file_size": file_size,
-            "row_count": row_count,
-            "column_count": column_count,
-            "columns": columns,
-            "uploaded_at": upload_doc["uploaded_at"],
-            "download_token": token_info["token"],
-            "download_token_expires_at": token_info["expires_at"],
-            "download_link": _build_public_url(f"/data/download/{token_info['token']}")
-        }
+        return await run_in_threadpool(_ingest_upload_contents, request, user, file.filename, contents, content_encoding)
         
     except HTTPException:
         raise
@@ -295,6 +1031,7 @@ def list_uploads(
             "filename": upload["filename"],
             "r2_key": upload["r2_key"],
             "file_hash": upload["file_hash"],
+            "content_encoding": upload.get("content_encoding"),
             "file_size": upload["file_size"],
             "row_count": upload["row_count"],
             "column_count": upload["column_count"],
@@ -336,6 +1073,7 @@ def get_upload_info(
             "filename": upload["filename"],
             "r2_key": upload["r2_key"],
             "file_hash": upload["file_hash"],
+            "content_encoding": upload.get("content_encoding"),
             "file_size": upload["file_size"],
             "row_count": upload["row_count"],
             "column_count": upload["column_count"],
@@ -349,6 +1087,45 @@ def get_upload_info(
         )
 
 
+@router.get("/data/upload/{file_id}/profile")
+def get_upload_profile(
+    file_id: str,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Column profile (dtypes, missing counts, numeric stats, sample rows) computed at upload
+
+    from bson import ObjectId
+
+    try:
+        upload = uploads_collection.find_one({
+            "_id": ObjectId(file_id),
+            "user_id": str(user["_id"])
+        })
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid file ID")
+
+    if not upload:
+        raise HTTPException(
+            status_code=404,
+            detail="File not found"
+        )
+
+    profile = load_profile(upload["file_hash"])
+    if not profile:
+        # Uploads from before profiling existed: stream it once and keep the result
+        profile = profile_upload(upload)
+        if upload.get("blob_id"):
+            store_profile(upload["file_hash"], profile)
+
+    return {
+        "file_id": file_id,
+        "filename": upload["filename"],
+        **json_safe(profile)
+    }
+
+
 @router.post("/data/upload/{file_id}/link")
 def create_download_link(
     file_id: str,
@@ -374,13 +1151,17 @@ def create_download_link(
                 detail="File not found"
             )
 
-        token_info = _create_download_token(str(user["_id"]), upload["r2_key"], request)
+        if DOWNLOAD_TOKEN_MODE == "stateless":
+            # Signed token: no database write to create the link
+            token_info = create_stateless_token(str(user["_id"]), str(upload["_id"]), upload["r2_key"], request)
+        else:
+            token_info = _create_download_token(str(user["_id"]), upload["r2_key"], request)
 
         return {
             "file_id": str(upload["_id"]),
             "download_token": token_info["token"],
             "download_token_expires_at": token_info["expires_at"],
-            "download_link": _build_public_url(f"/data/download/{token_info['token']}")
+            "download_link": build_public_url(f"/data/download/{token_info['token']}")
         }
     except Exception as e:
         raise HTTPException(
@@ -389,11 +1170,7 @@ def create_download_link(
         )
 
 
-@router.get("/data/download/{token}")
-def download_with_token(token: str, request: Request, response: Response):
-
-    #Validate token and return a short-lived presigned URL
-
+def _redeem_db_token(token: str, request: Request, response: Response) -> str:
     token_hash = _token_hash(token)
     token_doc = download_tokens_collection.find_one({"token_hash": token_hash})
 
@@ -408,7 +1185,7 @@ def download_with_token(token: str, request: Request, response: Response):
         raise HTTPException(status_code=410, detail="Download token already used")
 
     if DOWNLOAD_BIND_IP and token_doc.get("bind_ip"):
-        if token_doc["bind_ip"] != _client_ip(request):
+        if token_doc["bind_ip"] != client_ip(request):
             raise HTTPException(status_code=403, detail="Download token not valid for this IP")
 
     if DOWNLOAD_BIND_UA and token_doc.get("bind_ua"):
@@ -419,26 +1196,84 @@ def download_with_token(token: str, request: Request, response: Response):
 
     updated = download_tokens_collection.update_one(
         {"_id": token_doc["_id"], "used": False},
-        {"$set": {"used": True, "used_at": now, "used_ip": _client_ip(request)}}
+        {"$set": {"used": True, "used_at": now, "used_ip": client_ip(request)}}
     )
 
     if updated.modified_count == 0:
         raise HTTPException(status_code=410, detail="Download token already used")
 
+    return token_doc["r2_key"]
+
+
+def _redeem_signed_token(token: str, request: Request, response: Response) -> str:
+    from bson import ObjectId
+
+    claims = _verify_stateless_token(token)
+
+    if claims["e"] < time.time():
+        raise HTTPException(status_code=410, detail="Download token expired")
+
+    if claims.get("ip") and claims["ip"] != _token_hash(client_ip(request))[:16]:
+        raise HTTPException(status_code=403, detail="Download token not valid for this IP")
+
+    if claims.get("ua") and claims["ua"] != _token_hash(request.headers.get("user-agent", ""))[:16]:
+        raise HTTPException(status_code=403, detail="Download token not valid for this device")
+
+    enforce_download_token_general_limit(response, claims["u"])
+
+    # Nothing was stored at link time, so a deleted upload can't have its tokens revoked:
+    # check it still exists (blobs may outlive it when shared with other uploads)
+    if not uploads_collection.find_one({"_id": ObjectId(claims["f"]), "user_id": claims["u"]}, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if not _redeem_stateless_token(claims):
+        raise HTTPException(status_code=410, detail="Download token already used")
+
+    return claims["k"]
+
+
+@router.get("/data/download/{token}")
+def download_with_token(token: str, request: Request, response: Response, redirect: Optional[bool] = None):
+
+    #Validate token and return a short-lived presigned URL.
+    #With redirect (or DOWNLOAD_REDIRECT) answer 302 to R2 instead, saving the client a round trip.
+    #R2 serves Range requests on the presigned URL, so clients can resume or fetch parts
+    #of a file by re-requesting that URL (not the one-time token) while it is valid.
+
+    if token.startswith("v1."):
+        r2_key = _redeem_signed_token(token, request, response)
+    else:
+        r2_key = _redeem_db_token(token, request, response)
+
     try:
-        presigned_url = _generate_presigned_url(token_doc["r2_key"])
+        presigned_url, expires_in = _presigned_urls.get(r2_key)
     except ClientError as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to create download URL: {str(e)}"
         )
 
+    if DOWNLOAD_REDIRECT if redirect is None else redirect:
+        # Keep the rate limit headers; never let a one-time redirect be cached
+        headers = {key: value for key, value in response.headers.items() if key.startswith("x-ratelimit")}
+        headers["Cache-Control"] = "no-store"
+        return RedirectResponse(presigned_url, status_code=302, headers=headers)
+
     return {
         "download_url": presigned_url,
-        "expires_in": R2_PRESIGN_TTL_SECONDS
+        "expires_in": expires_in
     }
 
 
+def unclaimed_upload_filter() -> dict:
+    # Uploads no bulk delete has claimed (deleting_id); a claim older than
+    # BLOB_DELETE_STALE_SECONDS belongs to a delete that died half way and is ignored
+    return {"$or": [
+        {"deleting_id": {"$exists": False}},
+        {"deleting_at": {"$lt": datetime.utcnow() - timedelta(seconds=BLOB_DELETE_STALE_SECONDS)}}
+    ]}
+
+
 @router.delete("/data/upload/{file_id}")
 def delete_upload(
     file_id: str,
@@ -451,9 +1286,12 @@ def delete_upload(
     from bson import ObjectId
     
     try:
-        upload = uploads_collection.find_one({
+        # Delete the record first: of two concurrent deletes only one gets the document,
+        # so the shared blob reference and the usage counters are released exactly once
+        upload = uploads_collection.find_one_and_delete({
             "_id": ObjectId(file_id),
-            "user_id": str(user["_id"])
+            "user_id": str(user["_id"]),
+            **unclaimed_upload_filter()
         })
         
         if not upload:
@@ -462,22 +1300,34 @@ def delete_upload(
                 detail="File not found"
             )
         
-        # Delete from R2
+        release_usage(str(user["_id"]), upload["file_size"], upload.get("row_count", 0))
+        download_tokens_collection.delete_many({
+            "user_id": str(user["_id"]),
+            "r2_key": upload["r2_key"]
+        })
+        ai_summaries_collection.delete_many({
+            "user_id": str(user["_id"]),
+            "file_id": file_id
+        })
+        
+        # Delete from R2 (shared blobs only go away with their last reference)
         try:
-            s3_client.delete_object(
-                Bucket=R2_BUCKET_NAME,
-                Key=upload["r2_key"]
-            )
+            if upload.get("blob_id"):
+                release_blob(upload["blob_id"])
+            else:
+                s3_client.delete_object(
+                    Bucket=R2_BUCKET_NAME,
+                    Key=upload["r2_key"]
+                )
+                object_cache.discard(upload["r2_key"])
+                _presigned_urls.discard(upload["r2_key"])
         except ClientError as e:
+            # The upload is gone; reconcile.py removes the leftover object
             raise HTTPException(
                 status_code=500,
-                detail=f"Failed to delete from R2: {str(e)}"
+                detail=f"File deleted, but removing it from R2 failed: {str(e)}"
             )
         
-        # Delete metadata from MongoDB
-        uploads_collection.delete_one({"_id": ObjectId(file_id)})
-        download_tokens_collection.delete_many({"r2_key": upload["r2_key"]})
-        
         return {
             "message": "File deleted successfully from R2 and MongoDB",
             "file_id": file_id,
@@ -0,0 +1,278 @@
+import os
+import io
+import uuid
+import zipfile
+from datetime import datetime
+from typing import List
+
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from botocore.exceptions import ClientError
+
+from authbadapi import get_current_user
+from rate_limiter import require_general_limit, enforce_download_link_limit
+from upload import (
+    s3_client,
+    R2_BUCKET_NAME,
+    DOWNLOAD_TOKEN_MODE,
+    download_token_doc,
+    create_stateless_token,
+    build_public_url,
+    cleanup_deleted_uploads,
+    unclaimed_upload_filter
+)
+from usage import release_usage
+
+# Load .env
+load_dotenv()
+
+# MongoDB setup
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["auth_db"]
+uploads_collection = db["uploads"]
+download_tokens_collection = db["download_tokens"]
+
+BULK_MAX_FILES = int(os.getenv("BULK_MAX_FILES", "100"))
+DOWNLOAD_BUNDLE_MAX_FILES = int(os.getenv("DOWNLOAD_BUNDLE_MAX_FILES", "50"))
+DOWNLOAD_BUNDLE_CHUNK_BYTES = 1024 * 1024
+
+# Already-compressed uploads are stored in the zip as-is
+BUNDLE_STORED_ENCODINGS = {"gzip", "zstd"}
+
+# Create router
+router = APIRouter()
+
+
+class BulkFilesRequest(BaseModel):
+    file_ids: List[str]
+
+
+def _find_user_uploads(user: dict, file_ids: List[str], max_files: int):
+
+    #Resolve file_ids to the user's uploads with one $in query.
+    #Returns (file_ids deduplicated in request order, {file_id: upload}, {file_id: error}).
+
+    from bson import ObjectId
+
+    file_ids = list(dict.fromkeys(file_ids))
+    if not file_ids:
+        raise HTTPException(status_code=400, detail="file_ids must not be empty")
+    if len(file_ids) > max_files:
+        raise HTTPException(status_code=400, detail=f"At most {max_files} files per request")
+
+    errors = {}
+    object_ids = []
+    for file_id in file_ids:
+        try:
+            object_ids.append(ObjectId(file_id))
+        except Exception:
+            errors[file_id] = "Invalid file_id format"
+
+    uploads = {
+        str(upload["_id"]): upload
+        for upload in uploads_collection.find({"_id": {"$in": object_ids}, "user_id": str(user["_id"])})
+    }
+    for file_id in file_ids:
+        if file_id not in errors and file_id not in uploads:
+            errors[file_id] = "File not found"
+
+    return file_ids, uploads, errors
+
+
+@router.post("/data/uploads/links")
+def create_download_links(
+    data: BulkFilesRequest,
+    request: Request,
+    response: Response,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #One-time download links for many files: one $in lookup and one insert_many
+    #(no write at all with DOWNLOAD_TOKEN_MODE=stateless). Each link counts against the link limit.
+
+    file_ids, uploads, errors = _find_user_uploads(user, data.file_ids, BULK_MAX_FILES)
+
+    if uploads:
+        enforce_download_link_limit(request, response, user, cost=len(uploads))
+
+    user_id = str(user["_id"])
+    links = {}
+    token_docs = []
+    for file_id, upload in uploads.items():
+        if DOWNLOAD_TOKEN_MODE == "stateless":
+            token_info = create_stateless_token(user_id, file_id, upload["r2_key"], request)
+            token, expires_at = token_info["token"], token_info["expires_at"]
+        else:
+            token, token_doc = download_token_doc(user_id, upload["r2_key"], request)
+            token_docs.append(token_doc)
+            expires_at = token_doc["expires_at"]
+
+        links[file_id] = {
+            "file_id": file_id,
+            "download_token": token,
+            "download_token_expires_at": expires_at,
+            "download_link": build_public_url(f"/data/download/{token}")
+        }
+
+    if token_docs:
+        download_tokens_collection.insert_many(token_docs, ordered=False)
+
+    return {
+        "count": len(links),
+        "results": [
+            links[file_id] if file_id in links else {"file_id": file_id, "error": errors[file_id]}
+            for file_id in file_ids
+        ]
+    }
+
+
+class _ZipStream(io.RawIOBase):
+    # Write-only, unseekable sink for ZipFile: written bytes are collected until the
+    # response generator takes them, so only about one chunk is held in memory.
+    # zipfile falls back to data descriptors when it can't seek back to patch headers.
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _bundle_names(uploads: List[dict]) -> List[str]:
+    # Unique entry names: "data.csv", "data (2).csv", ...
+    seen = {}
+    names = []
+    for upload in uploads:
+        name = os.path.basename(upload["filename"]) or f"{upload['_id']}.csv"
+        base, dot, extension = name.partition(".")
+        count = seen.get(name.lower(), 0) + 1
+        seen[name.lower()] = count
+        names.append(name if count == 1 else f"{base} ({count}){dot}{extension}")
+    return names
+
+
+def _stream_bundle(uploads: List[dict]):
+    sink = _ZipStream()
+    with zipfile.ZipFile(sink, "w") as archive:
+        for upload, name in zip(uploads, _bundle_names(uploads)):
+            stored = upload.get("content_encoding") in BUNDLE_STORED_ENCODINGS
+            entry = zipfile.ZipInfo(name, date_time=upload["uploaded_at"].timetuple()[:6])
+            entry.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+
+            try:
+                body = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=upload["r2_key"])["Body"]
+            except ClientError:
+                # Headers are already sent: note the gap inside the archive instead of failing it
+                archive.writestr(f"{name}.error.txt", "Failed to download this file from storage\n")
+                yield sink.take()
+                continue
+
+            with archive.open(entry, "w", force_zip64=True) as target:
+                for chunk in body.iter_chunks(DOWNLOAD_BUNDLE_CHUNK_BYTES):
+                    target.write(chunk)
+                    yield sink.take()
+            yield sink.take()
+
+    yield sink.take()
+
+
+@router.post("/data/uploads/bundle")
+def download_bundle(
+    data: BulkFilesRequest,
+    request: Request,
+    response: Response,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Stream a zip of several uploads straight from R2.
+    #Objects are copied chunk by chunk into the archive as the client reads it,
+    #so memory stays around one chunk per request whatever the file sizes.
+
+    file_ids, uploads, errors = _find_user_uploads(user, data.file_ids, DOWNLOAD_BUNDLE_MAX_FILES)
+
+    if errors:
+        missing = next(iter(errors))
+        raise HTTPException(status_code=404, detail=f"{errors[missing]}: {missing}")
+
+    enforce_download_link_limit(request, response, user, cost=len(uploads))
+
+    headers = {key: value for key, value in response.headers.items() if key.startswith("x-ratelimit")}
+    headers["Content-Disposition"] = 'attachment; filename="badapi-bundle.zip"'
+
+    return StreamingResponse(
+        _stream_bundle([uploads[file_id] for file_id in file_ids]),
+        media_type="application/zip",
+        headers=headers
+    )
+
+
+@router.post("/data/uploads/delete", status_code=202)
+def bulk_delete_uploads(
+    data: BulkFilesRequest,
+    background_tasks: BackgroundTasks,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Delete many uploads at once. The upload records are removed before returning, so the
+    #files disappear from listings immediately; R2 objects (batched delete_objects), blob
+    #references, AI summaries and download tokens are cleaned up in a background task.
+
+    file_ids, uploads, errors = _find_user_uploads(user, data.file_ids, BULK_MAX_FILES)
+
+    # Claim, read back, delete: three round trips whatever the count. Only uploads carrying this
+    # request's deleting_id are released, so a concurrent delete of the same ids (bulk or single,
+    # which skips claimed uploads) can't release a blob reference or usage twice
+    user_id = str(user["_id"])
+    deleting_id = uuid.uuid4().hex
+    uploads_collection.update_many(
+        {"_id": {"$in": [upload["_id"] for upload in uploads.values()]}, "user_id": user_id, **unclaimed_upload_filter()},
+        {"$set": {"deleting_id": deleting_id, "deleting_at": datetime.utcnow()}}
+    )
+    deleted = {
+        str(upload["_id"]): upload
+        for upload in uploads_collection.find({"deleting_id": deleting_id, "user_id": user_id})
+    }
+    if deleted:
+        uploads_collection.delete_many({"deleting_id": deleting_id, "user_id": user_id})
+    for file_id in uploads:
+        if file_id not in deleted:
+            errors[file_id] = "File not found"
+
+    if deleted:
+        release_usage(
+            user_id,
+            sum(upload["file_size"] for upload in deleted.values()),
+            sum(upload.get("row_count", 0) for upload in deleted.values()),
+            files=len(deleted)
+        )
+        background_tasks.add_task(cleanup_deleted_uploads, user_id, list(deleted.values()))
+
+    return {
+        "message": f"{len(deleted)} files deleted; storage cleanup continues in the background",
+        "deleted": [file_id for file_id in file_ids if file_id in deleted],
+        "errors": [{"file_id": file_id, "error": errors[file_id]} for file_id in file_ids if file_id in errors]
+    }
@@ -0,0 +1,677 @@
+import os
+import asyncio
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Depends, Request
+from pydantic import BaseModel
+from pymongo import MongoClient
+from dotenv import load_dotenv
+from botocore.exceptions import ClientError
+from starlette.concurrency import run_in_threadpool
+
+from authbadapi import get_current_user
+from rate_limiter import require_general_limit, require_upload_limit
+from usage import check_quota, reserve_usage, release_usage
+from upload import (
+    s3_client,
+    R2_BUCKET_NAME,
+    MAX_FILE_SIZE_MB,
+    CSV_CONTENT_TYPES,
+    detect_csv_encoding,
+    scan_csv,
+    acquire_blob,
+    store_upload,
+    find_existing_upload,
+    existing_upload_response,
+    upload_response
+)
+
+# Load .env
+load_dotenv()
+
+# MongoDB setup
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["auth_db"]
+upload_sessions_collection = db["upload_sessions"]
+
+# R2 multipart parts must be at least 5 MB (except the last one)
+UPLOAD_CHUNK_SIZE_MB = max(int(os.getenv("UPLOAD_CHUNK_SIZE_MB", "8")), 5)
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", "86400"))
+# Expired sessions stay around this long so their R2 multipart upload can be aborted before TTL purges the record
+UPLOAD_SESSION_PURGE_GRACE_SECONDS = int(os.getenv("UPLOAD_SESSION_PURGE_GRACE_SECONDS", "86400"))
+R2_UPLOAD_PRESIGN_TTL_SECONDS = int(os.getenv("R2_UPLOAD_PRESIGN_TTL_SECONDS", "900"))
+# Background sweep of expired sessions across all users (0 disables it)
+UPLOAD_SESSION_SWEEP_SECONDS = int(os.getenv("UPLOAD_SESSION_SWEEP_SECONDS", "300"))
+UPLOAD_SESSION_SWEEP_BATCH = 100
+# A presigned session still "validating" after this long lost its background task (process restart)
+UPLOAD_SESSION_STALE_SECONDS = int(os.getenv("UPLOAD_SESSION_STALE_SECONDS", "3600"))
+
+upload_sessions_collection.create_index("purge_at", expireAfterSeconds=0)
+upload_sessions_collection.create_index([("user_id", 1), ("expires_at", 1)])
+upload_sessions_collection.create_index([("status", 1), ("expires_at", 1)])
+upload_sessions_collection.create_index([("status", 1), ("updated_at", 1)])
+
+# Create router
+router = APIRouter()
+
+_sweeper_tasks = []
+
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    file_size: int
+    file_hash: Optional[str] = None
+    content_encoding: Optional[str] = None
+
+
+def _get_session(session_id: str, user: dict) -> dict:
+    from bson import ObjectId
+
+    try:
+        session = upload_sessions_collection.find_one({
+            "_id": ObjectId(session_id),
+            "user_id": str(user["_id"])
+        })
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid session_id format")
+
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+
+    return session
+
+
+def _require_open_session(session: dict, kind: str):
+    if session.get("kind", "multipart") != kind:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Not a {kind} upload session"
+        )
+
+    if session["status"] != "uploading":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload session is {session['status']}"
+        )
+
+    if session["expires_at"] < datetime.utcnow():
+        raise HTTPException(status_code=410, detail="Upload session expired")
+
+
+def _abort_session(session: dict, status: str):
+    if session.get("kind") == "presigned":
+        _delete_staging_object(session["staging_key"])
+    else:
+        try:
+            s3_client.abort_multipart_upload(
+                Bucket=R2_BUCKET_NAME,
+                Key=session["staging_key"],
+                UploadId=session["r2_upload_id"]
+            )
+        except ClientError:
+            pass
+
+    upload_sessions_collection.update_one(
+        {"_id": session["_id"]},
+        {"$set": {"status": status, "updated_at": datetime.utcnow()}}
+    )
+
+
+def _sweep_expired_sessions(user_id: Optional[str] = None, limit: int = 20) -> int:
+    # Abandoned sessions: release their R2 parts/object before the TTL index drops the record
+    query = {"status": "uploading", "expires_at": {"$lt": datetime.utcnow()}}
+    if user_id:
+        query["user_id"] = user_id
+
+    swept = 0
+    for session in upload_sessions_collection.find(query).limit(limit):
+        _abort_session(session, "expired")
+        swept += 1
+    return swept
+
+
+def _sweep_stalled_sessions(limit: int) -> int:
+    # The staging object of a validation that never finished: nothing else would delete it,
+    # and the reconciler counts "validating" sessions as live owners
+    stalled = upload_sessions_collection.find({
+        "status": "validating",
+        "updated_at": {"$lt": datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_STALE_SECONDS)}
+    }).limit(limit)
+
+    swept = 0
+    for session in stalled:
+        claimed = upload_sessions_collection.update_one(
+            {"_id": session["_id"], "status": "validating", "updated_at": session["updated_at"]},
+            {"$set": {"status": "failed", "error": "Validation did not finish", "updated_at": datetime.utcnow()}}
+        )
+        if claimed.modified_count:
+            _delete_staging_object(session["staging_key"])
+        swept += 1
+    return swept
+
+
+def sweep_sessions(limit: int = UPLOAD_SESSION_SWEEP_BATCH) -> int:
+    # Expired sessions of every user (multipart parts and presigned staging objects) plus stalled validations
+    return _sweep_expired_sessions(None, limit) + _sweep_stalled_sessions(limit)
+
+
+async def _session_sweeper():
+    # Users who never come back would otherwise keep their multipart parts in R2 forever
+    while True:
+        try:
+            # Full batches mean there is a backlog: keep draining before sleeping
+            while await run_in_threadpool(sweep_sessions) >= UPLOAD_SESSION_SWEEP_BATCH:
+                pass
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Mongo/R2 hiccup: try again next round
+            pass
+        await asyncio.sleep(UPLOAD_SESSION_SWEEP_SECONDS)
+
+
+def start_session_sweeper():
+    if UPLOAD_SESSION_SWEEP_SECONDS > 0:
+        _sweeper_tasks.append(asyncio.create_task(_session_sweeper()))
+
+
+async def stop_session_sweeper():
+    for task in _sweeper_tasks:
+        task.cancel()
+    await asyncio.gather(*_sweeper_tasks, return_exceptions=True)
+    _sweeper_tasks.clear()
+
+
+def _expected_chunk_size(session: dict, chunk_number: int) -> int:
+    if chunk_number < session["total_chunks"]:
+        return session["chunk_size"]
+    return session["file_size"] - session["chunk_size"] * (session["total_chunks"] - 1)
+
+
+def _delete_staging_object(staging_key: str):
+    try:
+        s3_client.delete_object(Bucket=R2_BUCKET_NAME, Key=staging_key)
+    except ClientError:
+        pass
+
+
+def _session_response(session: dict) -> dict:
+    response = {
+        "session_id": str(session["_id"]),
+        "kind": session.get("kind", "multipart"),
+        "filename": session["filename"],
+        "file_size": session["file_size"],
+        "status": session["status"],
+        "file_id": session.get("file_id"),
+        "error": session.get("error"),
+        "expires_at": session["expires_at"]
+    }
+
+    if response["kind"] == "multipart":
+        parts = session.get("parts", {})
+        response.update({
+            "chunk_size": session["chunk_size"],
+            "total_chunks": session["total_chunks"],
+            "received_chunks": sorted(int(number) for number in parts),
+            "missing_chunks": [
+                number for number in range(1, session["total_chunks"] + 1)
+                if str(number) not in parts
+            ]
+        })
+
+    return response
+
+
+def _new_session(user: dict, data, staging_key: str, content_encoding: str, **fields) -> dict:
+    now = datetime.utcnow()
+    ttl = UPLOAD_SESSION_TTL_SECONDS
+    if fields.get("kind") == "presigned":
+        # The PUT URL must not outlive the session, or the sweep could delete the staging
+        # object before a late upload lands and leave that upload orphaned
+        ttl = max(ttl, R2_UPLOAD_PRESIGN_TTL_SECONDS)
+    expires_at = now + timedelta(seconds=ttl)
+    session = {
+        "user_id": str(user["_id"]),
+        "filename": data.filename,
+        "file_size": data.file_size,
+        "expected_hash": data.file_hash.lower() if data.file_hash else None,
+        "content_encoding": content_encoding,
+        "staging_key": staging_key,
+        "status": "uploading",
+        "created_at": now,
+        "updated_at": now,
+        "expires_at": expires_at,
+        "purge_at": expires_at + timedelta(seconds=UPLOAD_SESSION_PURGE_GRACE_SECONDS),
+        **fields
+    }
+    upload_sessions_collection.insert_one(session)
+    return session
+
+
+def _validate_new_session(data: UploadSessionRequest):
+    # Returns the content encoding of the file the client is about to send
+    content_encoding = detect_csv_encoding(data.filename, data.content_encoding)
+
+    if data.file_size <= 0:
+        raise HTTPException(status_code=400, detail="file_size must be positive")
+
+    if data.file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+        raise HTTPException(
+            status_code=413,
+            detail=f"File too large. Max size is {MAX_FILE_SIZE_MB} MB"
+        )
+
+    return content_encoding
+
+
+def _set_session_status(session: dict, status: str, **fields):
+    upload_sessions_collection.update_one(
+        {"_id": session["_id"]},
+        {"$set": {"status": status, "updated_at": datetime.utcnow(), **fields}}
+    )
+
+
+def ingest_staged_object(user: dict, filename: str, staging_key: str, expected_hash: str = None, content_encoding: str = None):
+
+    #Validate an object already sitting in R2 and register it like a regular upload.
+    #Returns (upload document, True if the user already had this content)
+
+    # Stream the object once: the parser pulls (decompressed) bytes through the hasher
+    try:
+        body = s3_client.get_object(Bucket=R2_BUCKET_NAME, Key=staging_key)["Body"]
+    except ClientError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to read staged upload from R2: {str(e)}"
+        )
+
+    df, file_hash, file_size = scan_csv(body, content_encoding)
+
+    if expected_hash and expected_hash.lower() != file_hash:
+        raise HTTPException(
+            status_code=400,
+            detail="SHA-256 mismatch: assembled file does not match file_hash"
+        )
+
+    existing_file = find_existing_upload(user, file_hash)
+    if existing_file:
+        return existing_file, True
+
+    # Reserve quota for the real size before the staged object is copied to its blob
+    reserve_usage(str(user["_id"]), file_size, len(df))
+    try:
+        blob = acquire_blob(file_hash, file_size, copy_from=staging_key, content_encoding=content_encoding)
+        upload_doc = store_upload(user, filename, blob, file_size, df)
+    except Exception:
+        release_usage(str(user["_id"]), file_size, len(df))
+        raise
+    return upload_doc, False
+
+
+@router.post("/data/upload/sessions")
+def create_upload_session(
+    data: UploadSessionRequest,
+    request: Request,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit),
+    _upload_limit: None = Depends(require_upload_limit)
+):
+
+    #Start a resumable upload: the client then PUTs chunks and calls /complete
+
+    content_encoding = _validate_new_session(data)
+
+    if data.file_hash:
+        existing_file = find_existing_upload(user, data.file_hash.lower())
+        if existing_file:
+            return existing_upload_response(user, existing_file, request)
+
+    # Refuse before the client sends any bytes if the declared size can't fit
+    check_quota(str(user["_id"]), data.file_size)
+
+    _sweep_expired_sessions(str(user["_id"]))
+
+    chunk_size = UPLOAD_CHUNK_SIZE_MB * 1024 * 1024
+    staging_key = f"staging/{user['_id']}/{uuid.uuid4()}.csv"
+
+    try:
+        multipart = s3_client.create_multipart_upload(
+            Bucket=R2_BUCKET_NAME,
+            Key=staging_key,
+            ContentType=CSV_CONTENT_TYPES[content_encoding]
+        )
+    except ClientError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to start R2 multipart upload: {str(e)}"
+        )
+
+    session = _new_session(
+        user,
+        data,
+        staging_key,
+        content_encoding,
+        kind="multipart",
+        r2_upload_id=multipart["UploadId"],
+        chunk_size=chunk_size,
+        total_chunks=-(-data.file_size // chunk_size),
+        parts={}
+    )
+
+    return _session_response(session)
+
+
+async def _read_chunk_body(request: Request, max_bytes: int) -> bytes:
+    # Never buffer more than one chunk: refuse an oversized Content-Length up front,
+    # then stream the body with a running cap (the header may be absent or wrong)
+    too_large = HTTPException(status_code=413, detail=f"Chunk must not exceed {max_bytes} bytes")
+
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        try:
+            declared = int(content_length)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+        if declared > max_bytes:
+            raise too_large
+
+    body = bytearray()
+    async for piece in request.stream():
+        body.extend(piece)
+        if len(body) > max_bytes:
+            raise too_large
+    return bytes(body)
+
+
+@router.put("/data/upload/sessions/{session_id}/chunks/{chunk_number}")
+async def upload_chunk(
+    session_id: str,
+    chunk_number: int,
+    request: Request,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Upload one chunk (raw request body); re-sending a chunk number replaces it
+
+    session = _get_session(session_id, user)
+    _require_open_session(session, "multipart")
+
+    if chunk_number < 1 or chunk_number > session["total_chunks"]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"chunk_number must be between 1 and {session['total_chunks']}"
+        )
+
+    expected_size = _expected_chunk_size(session, chunk_number)
+    chunk = await _read_chunk_body(request, expected_size)
+    if len(chunk) != expected_size:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Chunk {chunk_number} must be exactly {expected_size} bytes"
+        )
+
+    chunk_hash = hashlib.sha256(chunk).hexdigest()
+    claimed_hash = request.headers.get("x-chunk-sha256")
+    if claimed_hash and claimed_hash.lower() != chunk_hash:
+        raise HTTPException(status_code=400, detail="Chunk SHA-256 mismatch")
+
+    try:
+        part = s3_client.upload_part(
+            Bucket=R2_BUCKET_NAME,
+            Key=session["staging_key"],
+            UploadId=session["r2_upload_id"],
+            PartNumber=chunk_number,
+            Body=chunk
+        )
+    except ClientError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to upload chunk to R2: {str(e)}"
+        )
+
+    upload_sessions_collection.update_one(
+        {"_id": session["_id"]},
+        {"$set": {
+            f"parts.{chunk_number}": {
+                "etag": part["ETag"],
+                "size": len(chunk),
+                "sha256": chunk_hash,
+                "uploaded_at": datetime.utcnow()
+            },
+            "updated_at": datetime.utcnow()
+        }}
+    )
+
+    return {
+        "session_id": session_id,
+        "chunk_number": chunk_number,
+        "sha256": chunk_hash,
+        "size": len(chunk)
+    }
+
+
+@router.get("/data/upload/sessions/{session_id}")
+def get_upload_session(
+    session_id: str,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Resume point for chunked uploads, validation status for presigned ones
+
+    return _session_response(_get_session(session_id, user))
+
+
+@router.post("/data/upload/sessions/{session_id}/complete")
+def complete_upload_session(
+    session_id: str,
+    request: Request,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Assemble the chunks in R2, then validate exactly like /data/upload
+
+    session = _get_session(session_id, user)
+    _require_open_session(session, "multipart")
+
+    parts = session.get("parts", {})
+    missing = [n for n in range(1, session["total_chunks"] + 1) if str(n) not in parts]
+    if missing:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Missing chunks: {missing[:50]}"
+        )
+
+    # Only one completion may run per session
+    claimed = upload_sessions_collection.update_one(
+        {"_id": session["_id"], "status": "uploading"},
+        {"$set": {"status": "assembling", "updated_at": datetime.utcnow()}}
+    )
+    if claimed.modified_count == 0:
+        raise HTTPException(status_code=409, detail="Upload session is already completing")
+
+    try:
+        s3_client.complete_multipart_upload(
+            Bucket=R2_BUCKET_NAME,
+            Key=session["staging_key"],
+            UploadId=session["r2_upload_id"],
+            MultipartUpload={
+                "Parts": [
+                    {"ETag": parts[str(n)]["etag"], "PartNumber": n}
+                    for n in range(1, session["total_chunks"] + 1)
+                ]
+            }
+        )
+    except ClientError as e:
+        _abort_session(session, "failed")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to assemble upload in R2: {str(e)}"
+        )
+
+    try:
+        upload_doc, duplicate = ingest_staged_object(
+            user,
+            session["filename"],
+            session["staging_key"],
+            expected_hash=session.get("expected_hash"),
+            content_encoding=session.get("content_encoding")
+        )
+    except HTTPException as e:
+        _set_session_status(session, "failed", error=e.detail)
+        raise
+    except Exception as e:
+        _set_session_status(session, "failed", error=str(e))
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing file: {str(e)}"
+        )
+    finally:
+        _delete_staging_object(session["staging_key"])
+
+    _set_session_status(session, "completed", file_id=str(upload_doc["_id"]))
+
+    if duplicate:
+        return existing_upload_response(user, upload_doc, request)
+    return upload_response(user, upload_doc, request)
+
+
+def _validate_presigned_upload(session: dict, user: dict):
+    # Runs after the response is sent; the client polls the session for the outcome
+    try:
+        upload_doc, _duplicate = ingest_staged_object(
+            user,
+            session["filename"],
+            session["staging_key"],
+            expected_hash=session.get("expected_hash"),
+            content_encoding=session.get("content_encoding")
+        )
+    except HTTPException as e:
+        _set_session_status(session, "failed", error=e.detail)
+    except Exception as e:
+        _set_session_status(session, "failed", error=f"Error processing file: {str(e)}")
+    else:
+        _set_session_status(session, "completed", file_id=str(upload_doc["_id"]))
+    finally:
+        _delete_staging_object(session["staging_key"])
+
+
+@router.post("/data/upload/presigned")
+def create_presigned_upload(
+    data: UploadSessionRequest,
+    request: Request,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit),
+    _upload_limit: None = Depends(require_upload_limit)
+):
+
+    #Issue a presigned PUT URL so the file goes straight to R2 instead of through the API
+
+    content_encoding = _validate_new_session(data)
+
+    if data.file_hash:
+        existing_file = find_existing_upload(user, data.file_hash.lower())
+        if existing_file:
+            return existing_upload_response(user, existing_file, request)
+
+    # Refuse before the client sends any bytes if the declared size can't fit
+    check_quota(str(user["_id"]), data.file_size)
+
+    _sweep_expired_sessions(str(user["_id"]))
+
+    staging_key = f"staging/{user['_id']}/{uuid.uuid4()}.csv"
+
+    try:
+        upload_url = s3_client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": R2_BUCKET_NAME,
+                "Key": staging_key,
+                "ContentType": CSV_CONTENT_TYPES[content_encoding]
+            },
+            ExpiresIn=R2_UPLOAD_PRESIGN_TTL_SECONDS,
+            HttpMethod="PUT"
+        )
+    except ClientError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to create upload URL: {str(e)}"
+        )
+
+    session = _new_session(user, data, staging_key, content_encoding, kind="presigned")
+
+    return {
+        **_session_response(session),
+        "upload_url": upload_url,
+        "upload_method": "PUT",
+        "upload_headers": {"Content-Type": CSV_CONTENT_TYPES[content_encoding]},
+        "upload_url_expires_in": R2_UPLOAD_PRESIGN_TTL_SECONDS
+    }
+
+
+@router.post("/data/upload/presigned/{session_id}/complete", status_code=202)
+def complete_presigned_upload(
+    session_id: str,
+    background_tasks: BackgroundTasks,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Confirm the direct upload; validation runs in the background
+
+    session = _get_session(session_id, user)
+    _require_open_session(session, "presigned")
+
+    try:
+        head = s3_client.head_object(Bucket=R2_BUCKET_NAME, Key=session["staging_key"])
+    except ClientError:
+        raise HTTPException(status_code=400, detail="File has not been uploaded to the presigned URL yet")
+
+    if head["ContentLength"] != session["file_size"]:
+        _abort_session(session, "failed")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Uploaded size {head['ContentLength']} does not match declared file_size {session['file_size']}"
+        )
+
+    claimed = upload_sessions_collection.update_one(
+        {"_id": session["_id"], "status": "uploading"},
+        {"$set": {"status": "validating", "updated_at": datetime.utcnow()}}
+    )
+    if claimed.modified_count == 0:
+        raise HTTPException(status_code=409, detail="Upload session is already completing")
+
+    background_tasks.add_task(_validate_presigned_upload, session, user)
+
+    session["status"] = "validating"
+    return _session_response(session)
+
+
+@router.delete("/data/upload/sessions/{session_id}")
+def abort_upload_session(
+    session_id: str,
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Abort an upload session and release whatever it staged in R2
+
+    session = _get_session(session_id, user)
+    if session["status"] != "uploading":
+        raise HTTPException(
+            status_code=409,
+            detail=f"Upload session is {session['status']}"
+        )
+
+    _abort_session(session, "aborted")
+
+    return {
+        "message": "Upload session aborted",
+        "session_id": session_id
+    }
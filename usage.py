@@ -0,0 +1,162 @@
+import os
+from datetime import datetime
+
+from fastapi import APIRouter, HTTPException, Depends
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+
+from authbadapi import get_current_user
+from rate_limiter import require_general_limit
+
+# Load .env
+load_dotenv()
+
+# MongoDB setup
+MONGO_URI = os.getenv("MONGO_URI")
+client = MongoClient(MONGO_URI)
+db = client["auth_db"]
+uploads_collection = db["uploads"]
+usage_collection = db["usage"]
+
+# Per-user storage quota; 0 means unlimited. file_size is the decompressed CSV size.
+STORAGE_QUOTA_MB = int(os.getenv("STORAGE_QUOTA_MB", "0"))
+STORAGE_QUOTA_FILES = int(os.getenv("STORAGE_QUOTA_FILES", "0"))
+STORAGE_QUOTA_ROWS = int(os.getenv("STORAGE_QUOTA_ROWS", "0"))
+
+# Create router
+router = APIRouter()
+
+
+def _backfill_usage(user_id: str):
+    # First use for this user: count the existing uploads once, then keep the counters incrementally.
+    # Uploads or deletes racing the backfill can leave it off by that one file.
+    totals = next(uploads_collection.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {
+            "_id": None,
+            "bytes": {"$sum": "$file_size"},
+            "files": {"$sum": 1},
+            "rows": {"$sum": "$row_count"}
+        }}
+    ]), {})
+
+    try:
+        usage_collection.insert_one({
+            "_id": user_id,
+            "bytes": totals.get("bytes", 0),
+            "files": totals.get("files", 0),
+            "rows": totals.get("rows", 0),
+            "updated_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        # Another request backfilled first
+        pass
+
+
+def get_usage(user_id: str) -> dict:
+    usage = usage_collection.find_one({"_id": user_id})
+    if not usage:
+        _backfill_usage(user_id)
+        usage = usage_collection.find_one({"_id": user_id})
+    return usage
+
+
+def _quota_conditions(file_size: int, row_count: int) -> dict:
+    # The counters must stay within quota after adding this upload
+    conditions = {}
+    if STORAGE_QUOTA_MB:
+        conditions["bytes"] = {"$lte": STORAGE_QUOTA_MB * 1024 * 1024 - file_size}
+    if STORAGE_QUOTA_FILES:
+        conditions["files"] = {"$lte": STORAGE_QUOTA_FILES - 1}
+    if STORAGE_QUOTA_ROWS:
+        conditions["rows"] = {"$lte": STORAGE_QUOTA_ROWS - row_count}
+    return conditions
+
+
+def _quota_exceeded(usage: dict) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail={
+            "message": "Storage quota exceeded",
+            "usage": usage_response(usage)
+        }
+    )
+
+
+def check_quota(user_id: str, file_size: int, row_count: int = 0):
+
+    #Read-only check, for upload sessions that only know the declared size.
+    #The upload is still reserved with reserve_usage once its content is validated.
+
+    conditions = _quota_conditions(file_size, row_count)
+    if not conditions:
+        return
+
+    usage = get_usage(user_id)
+    if any(usage.get(field, 0) > condition["$lte"] for field, condition in conditions.items()):
+        raise _quota_exceeded(usage)
+
+
+def reserve_usage(user_id: str, file_size: int, row_count: int):
+
+    #Count an upload against the user's quota before it is written to R2.
+    #The check and the increment are one conditional update, so concurrent uploads
+    #can't overshoot. Undo with release_usage if the upload fails afterwards.
+
+    update = {
+        "$inc": {"bytes": file_size, "files": 1, "rows": row_count},
+        "$set": {"updated_at": datetime.utcnow()}
+    }
+    conditions = {"_id": user_id, **_quota_conditions(file_size, row_count)}
+
+    if usage_collection.update_one(conditions, update).matched_count:
+        return
+
+    usage = get_usage(user_id)
+    if usage_collection.update_one(conditions, update).matched_count:
+        return
+
+    raise _quota_exceeded(usage)
+
+
+def release_usage(user_id: str, file_size: int, row_count: int, files: int = 1):
+    # No upsert: without a counter document the next backfill counts from uploads anyway
+    usage_collection.update_one(
+        {"_id": user_id},
+        {
+            "$inc": {"bytes": -file_size, "files": -files, "rows": -row_count},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+    )
+
+
+def usage_response(usage: dict) -> dict:
+    quotas = {
+        "bytes": STORAGE_QUOTA_MB * 1024 * 1024 or None,
+        "files": STORAGE_QUOTA_FILES or None,
+        "rows": STORAGE_QUOTA_ROWS or None
+    }
+    return {
+        name: {
+            "used": usage.get(name, 0),
+            "quota": quota,
+            "remaining": max(quota - usage.get(name, 0), 0) if quota else None
+        }
+        for name, quota in quotas.items()
+    }
+
+
+@router.get("/data/usage")
+def get_storage_usage(
+    user: dict = Depends(get_current_user),
+    _general_limit: None = Depends(require_general_limit)
+):
+
+    #Storage used by the authenticated user against their quota (null quota = unlimited)
+
+    usage = get_usage(str(user["_id"]))
+    return {
+        **usage_response(usage),
+        "updated_at": usage.get("updated_at")
+    }